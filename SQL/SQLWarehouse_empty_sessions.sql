@@ -0,0 +1,13 @@
+-- Adds the table of sessions a download came back empty for to an existing warehouse
+-- dw_sync fills it and skips those sessions from then on
+USE StockDataWarehouse;
+GO
+
+IF OBJECT_ID('dbo.StockEmptySessions', 'U') IS NULL
+CREATE TABLE dbo.StockEmptySessions (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    Date DATE NOT NULL,
+    CheckedAt DATETIME2(0),
+    CONSTRAINT PK_StockEmptySessions PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+);
+GO
@@ -0,0 +1,20 @@
+-- Adds the precomputed indicator table to an existing warehouse
+-- Fill it afterwards with python indicator_job.py
+USE StockDataWarehouse;
+GO
+
+IF OBJECT_ID('dbo.StockIndicators', 'U') IS NULL
+CREATE TABLE dbo.StockIndicators (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    Date DATE NOT NULL,
+    SMA50 FLOAT,
+    SMA200 FLOAT,
+    EMA50 FLOAT,
+    EMA200 FLOAT,
+    RSI14 FLOAT,
+    BB20_Upper FLOAT,
+    BB20_Middle FLOAT,
+    BB20_Lower FLOAT,
+    CONSTRAINT PK_StockIndicators PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+);
+GO
@@ -0,0 +1,42 @@
+-- Moves an existing warehouse to one row per (TickerSymbol, Date)
+-- Replaces supportive/DataWarehouseMaintenance_Delete_Duplicates.sql, once the unique index exists duplicates cannot be inserted
+USE StockDataWarehouse;
+GO
+
+-- removing duplicate days, keeping the first row loaded for each ticker and date
+WITH Ranked AS (
+    SELECT StockID,
+           ROW_NUMBER() OVER (PARTITION BY TickerSymbol, [Date] ORDER BY StockID) AS RowNumber
+    FROM dbo.StockInformation
+)
+DELETE FROM Ranked
+WHERE RowNumber > 1;
+GO
+
+-- the key columns of a unique clustered index cannot be NULL
+DELETE FROM dbo.StockInformation
+WHERE TickerSymbol IS NULL OR [Date] IS NULL;
+
+ALTER TABLE dbo.StockInformation ALTER COLUMN TickerSymbol NVARCHAR(10) NOT NULL;
+ALTER TABLE dbo.StockInformation ALTER COLUMN [Date] DATE NOT NULL;
+GO
+
+-- the IDENTITY primary key was created clustered with a generated name, it is rebuilt as nonclustered
+DECLARE @primary_key SYSNAME = (
+    SELECT name
+    FROM sys.key_constraints
+    WHERE parent_object_id = OBJECT_ID('dbo.StockInformation') AND type = 'PK'
+);
+IF @primary_key IS NOT NULL
+    EXEC('ALTER TABLE dbo.StockInformation DROP CONSTRAINT ' + @primary_key);
+GO
+
+ALTER TABLE dbo.StockInformation
+ADD CONSTRAINT PK_StockInformation PRIMARY KEY NONCLUSTERED (StockID);
+GO
+
+-- one row per ticker and day, clustered so range queries for a ticker are a single index seek
+-- the clustered index holds every column including ClosePrice so no lookups are needed
+CREATE UNIQUE CLUSTERED INDEX UX_StockInformation_Ticker_Date
+ON dbo.StockInformation (TickerSymbol, [Date]);
+GO
@@ -0,0 +1,34 @@
+-- Adds the weekly and monthly bar tables to an existing warehouse
+-- Fill them afterwards with python rollups.py, DW_Stock keeps them up to date from then on
+USE StockDataWarehouse;
+GO
+
+IF OBJECT_ID('dbo.StockWeekly', 'U') IS NULL
+CREATE TABLE dbo.StockWeekly (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    PeriodStart DATE NOT NULL,
+    PeriodEnd DATE NOT NULL,
+    OpenPrice FLOAT,
+    ClosePrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    Volume BIGINT,
+    DayCount INT,
+    CONSTRAINT PK_StockWeekly PRIMARY KEY CLUSTERED (TickerSymbol, PeriodStart)
+);
+GO
+
+IF OBJECT_ID('dbo.StockMonthly', 'U') IS NULL
+CREATE TABLE dbo.StockMonthly (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    PeriodStart DATE NOT NULL,
+    PeriodEnd DATE NOT NULL,
+    OpenPrice FLOAT,
+    ClosePrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    Volume BIGINT,
+    DayCount INT,
+    CONSTRAINT PK_StockMonthly PRIMARY KEY CLUSTERED (TickerSymbol, PeriodStart)
+);
+GO
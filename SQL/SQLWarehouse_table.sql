@@ -2,12 +2,86 @@ USE StockDataWarehouse;
 GO
 
 CREATE TABLE StockInformation (
-    StockID INT PRIMARY KEY IDENTITY(1,1),
-    TickerSymbol NVARCHAR(10),
-    Date DATE,
+    StockID INT IDENTITY(1,1) NOT NULL,
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    Date DATE NOT NULL,
     OpenPrice FLOAT,
     ClosePrice FLOAT,
     HighPrice FLOAT,
     LowPrice FLOAT,
-    Volume BIGINT
-);
\ No newline at end of file
+    Volume BIGINT,
+    CONSTRAINT PK_StockInformation PRIMARY KEY NONCLUSTERED (StockID)
+);
+GO
+
+-- one row per ticker and day, clustered so range queries for a ticker are a single index seek
+-- the clustered index holds every column including ClosePrice so no lookups are needed
+CREATE UNIQUE CLUSTERED INDEX UX_StockInformation_Ticker_Date
+ON StockInformation (TickerSymbol, Date);
+GO
+
+-- one row per stock held in the warehouse, kept up to date by DW_Stock after every load and update
+CREATE TABLE StockTickers (
+    TickerSymbol NVARCHAR(10) NOT NULL PRIMARY KEY,
+    FirstDate DATE,
+    LastDate DATE,
+    DayCount INT,
+    LastSync DATETIME2(0)
+);
+GO
+
+-- sessions a download came back without although the ticker traded after them eg. a halt or an unscheduled closure
+-- dw_sync skips them instead of asking for them again every night
+CREATE TABLE StockEmptySessions (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    Date DATE NOT NULL,
+    CheckedAt DATETIME2(0),
+    CONSTRAINT PK_StockEmptySessions PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+);
+GO
+
+-- indicators precomputed by indicator_job.py, one row per ticker and day like StockInformation
+CREATE TABLE StockIndicators (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    Date DATE NOT NULL,
+    SMA50 FLOAT,
+    SMA200 FLOAT,
+    EMA50 FLOAT,
+    EMA200 FLOAT,
+    RSI14 FLOAT,
+    BB20_Upper FLOAT,
+    BB20_Middle FLOAT,
+    BB20_Lower FLOAT,
+    CONSTRAINT PK_StockIndicators PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+);
+GO
+
+-- weekly and monthly bars rolled up from StockInformation by rollups.py, keyed by the first day of each period
+-- weeks start on Monday, PeriodEnd is the last trading day seen in the period
+CREATE TABLE StockWeekly (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    PeriodStart DATE NOT NULL,
+    PeriodEnd DATE NOT NULL,
+    OpenPrice FLOAT,
+    ClosePrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    Volume BIGINT,
+    DayCount INT,
+    CONSTRAINT PK_StockWeekly PRIMARY KEY CLUSTERED (TickerSymbol, PeriodStart)
+);
+GO
+
+CREATE TABLE StockMonthly (
+    TickerSymbol NVARCHAR(10) NOT NULL,
+    PeriodStart DATE NOT NULL,
+    PeriodEnd DATE NOT NULL,
+    OpenPrice FLOAT,
+    ClosePrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    Volume BIGINT,
+    DayCount INT,
+    CONSTRAINT PK_StockMonthly PRIMARY KEY CLUSTERED (TickerSymbol, PeriodStart)
+);
+GO
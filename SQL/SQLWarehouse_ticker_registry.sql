@@ -0,0 +1,21 @@
+-- Adds the ticker registry to an existing warehouse and fills it from the prices already held
+-- Replaces supportive/stock_list.txt as the list of stocks the update jobs run over
+USE StockDataWarehouse;
+GO
+
+IF OBJECT_ID('dbo.StockTickers', 'U') IS NULL
+CREATE TABLE dbo.StockTickers (
+    TickerSymbol NVARCHAR(10) NOT NULL PRIMARY KEY,
+    FirstDate DATE,
+    LastDate DATE,
+    DayCount INT,
+    LastSync DATETIME2(0)
+);
+GO
+
+INSERT INTO dbo.StockTickers (TickerSymbol, FirstDate, LastDate, DayCount, LastSync)
+SELECT s.TickerSymbol, MIN(s.[Date]), MAX(s.[Date]), COUNT(*), SYSDATETIME()
+FROM dbo.StockInformation s
+WHERE NOT EXISTS (SELECT 1 FROM dbo.StockTickers t WHERE t.TickerSymbol = s.TickerSymbol)
+GROUP BY s.TickerSymbol;
+GO
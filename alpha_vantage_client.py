@@ -0,0 +1,298 @@
+# The purpose of this file is to download daily price histories from Alpha Vantage without blocking the web application
+# Requests share one keep-alive aiohttp session and go through a token bucket sized to the API tier, throttling and
+# transient failures are retried with exponential backoff. New tickers are onboarded by a background thread running
+# its own event loop, the web request only puts the ticker on the queue.
+
+import asyncio
+import random
+import threading
+import time
+
+import aiohttp
+import pandas as pd
+
+from connection_pool import load_config
+
+DEFAULT_BASE_URL = "https://www.alphavantage.co/query"
+
+# HTTP statuses worth trying again, anything else is the request's fault
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AlphaVantageError(Exception):
+    """The API answered but did not return a price history"""
+
+
+class RateLimited(AlphaVantageError):
+    """The API reported the request was throttled ("Note" or "Information" in the response)"""
+
+
+class InvalidSymbol(AlphaVantageError):
+    """The API rejected the request ("Error Message" in the response), retrying will not help"""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Rate limiter shared by every request of a client
+        rate: tokens added per second eg. 5 / 60 for five requests a minute
+        capacity: most tokens held at once, the size of a burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _fill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Waits until a request may be sent"""
+        # the lock makes waiting requests go out in the order they asked
+        async with self._lock:
+            self._fill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._fill()
+            self.tokens -= 1
+
+    def drain(self):
+        """Empties the bucket after the API reported throttling so every waiting request slows down"""
+        self._fill()
+        self.tokens = min(self.tokens, 0)
+
+
+def time_series_frame(data):
+    """
+    Converts a TIME_SERIES_DAILY response to the frame DW_Stock.dw_bulk_load takes
+    data: decoded JSON response
+    Raises RateLimited, InvalidSymbol or AlphaVantageError when the response holds no prices
+    """
+    # throttled and rejected calls still answer 200 with a message instead of the time series
+    if "Error Message" in data:
+        raise InvalidSymbol(data["Error Message"])
+    for key in ("Note", "Information"):
+        if key in data:
+            raise RateLimited(data[key])
+    time_series = data.get("Time Series (Daily)")
+    if not time_series:
+        raise AlphaVantageError("response has no daily time series")
+
+    df = pd.DataFrame.from_dict(time_series, orient="index")
+    df["Date"] = pd.to_datetime(df.index)
+    df["OpenPrice"] = pd.to_numeric(df["1. open"])
+    df["ClosePrice"] = pd.to_numeric(df["4. close"])
+    df["HighPrice"] = pd.to_numeric(df["2. high"])
+    df["LowPrice"] = pd.to_numeric(df["3. low"])
+    df["Volume"] = pd.to_numeric(df["5. volume"])
+    return df[["Date", "OpenPrice", "ClosePrice", "HighPrice", "LowPrice", "Volume"]].sort_values("Date").reset_index(drop=True)
+
+
+class AlphaVantageClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, requests_per_minute=5, burst=1, retries=3, backoff=2.0,
+                 timeout=30, connections=4):
+        """
+        Async client for the Alpha Vantage daily prices, use it as an async context manager
+        api_key: Alpha Vantage API key
+        base_url: query endpoint, pointed at a local server for testing
+        requests_per_minute: the limit of the API tier
+        burst: requests that may go out back to back before the rate applies
+        retries: attempts after a throttled or failed request
+        backoff: seconds before the first retry, doubled for every following one
+        timeout: seconds a request may take in total
+        connections: keep-alive connections held open to the API
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.connections = connections
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.session = None
+
+    @classmethod
+    def from_config(cls):
+        """Client configured from the Alpha Vantage section of the configuration file"""
+        section = load_config()["Alpha Vantage"]
+        return cls(
+            section["api_key"],
+            base_url=section.get("base_url", DEFAULT_BASE_URL),
+            requests_per_minute=section.getfloat("requests_per_minute", 5),
+            burst=section.getint("burst", 1),
+            retries=section.getint("retries", 3),
+            backoff=section.getfloat("backoff", 2.0),
+            timeout=section.getfloat("timeout", 30),
+        )
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             connector=aiohttp.TCPConnector(limit=self.connections))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def _get(self, params):
+        """One rate limited request, returns the decoded JSON"""
+        await self.bucket.acquire()
+        async with self.session.get(self.base_url, params=params) as response:
+            if response.status in RETRY_STATUSES:
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=response.reason)
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def daily(self, symbol, outputsize="full"):
+        """
+        Daily prices of a ticker
+        symbol: ticker name eg "AAPL"
+        outputsize: "full" for the whole history, "compact" for the last 100 days
+        Returns a frame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns
+        """
+        params = {"function": "TIME_SERIES_DAILY", "symbol": symbol, "apikey": self.api_key, "outputsize": outputsize}
+        for attempt in range(self.retries + 1):
+            try:
+                return time_series_frame(await self._get(params))
+            except InvalidSymbol:
+                raise
+            except (AlphaVantageError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                    raise
+                if isinstance(e, RateLimited):
+                    self.bucket.drain()
+                if attempt == self.retries:
+                    raise
+                # jitter keeps retries from several tickers from landing together
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                print(f"{symbol}: attempt {attempt + 1} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def daily_many(self, symbols, outputsize="full"):
+        """
+        Daily prices of several tickers fetched concurrently within the rate limit
+        Returns a dict of ticker to frame, or to the exception for the tickers that failed
+        """
+        results = await asyncio.gather(*(self.daily(symbol, outputsize) for symbol in symbols), return_exceptions=True)
+        return dict(zip(symbols, results))
+
+
+def fetch_daily(symbol, client=None):
+    """
+    Blocking helper for scripts, downloads the full daily history of one ticker
+    client: optional AlphaVantageClient, defaults to one configured from the configuration file
+    """
+    async def run():
+        async with (client or AlphaVantageClient.from_config()) as session:
+            return await session.daily(symbol)
+    return asyncio.run(run())
+
+
+class OnboardingQueue:
+    def __init__(self, load, client_factory=AlphaVantageClient.from_config, workers=2):
+        """
+        Downloads new tickers on a background thread and hands each history to a loader
+        load: blocking function taking (ticker, frame) that writes the history, run on a worker thread of the loop
+        client_factory: function returning the AlphaVantageClient to use
+        workers: tickers downloaded at the same time, the token bucket still caps the request rate
+        """
+        self.load = load
+        self.client_factory = client_factory
+        self.workers = workers
+        # ticker to "queued", "loading", "done" or "failed", read by the web application
+        self.status = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the background thread if it is not running yet"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        """start for callers already holding the lock, returns once the thread's loop accepts tickers"""
+        if self._thread is None:
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="alpha-vantage-onboarding", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        try:
+            loop.run_until_complete(self._serve())
+        except Exception as e:
+            # the client could not be built eg. no api key, the waiting tickers fail and the next submit starts a new thread
+            print(f"Onboarding stopped ({e})")
+            with self._lock:
+                self._thread = None
+                for ticker, state in self.status.items():
+                    if state in ("queued", "loading"):
+                        self.status[ticker] = "failed"
+                        self.errors[ticker] = e
+            loop.close()
+
+    async def _serve(self):
+        async with self.client_factory() as client:
+            await asyncio.gather(*(self._worker(client) for _ in range(self.workers)))
+
+    async def _worker(self, client):
+        while True:
+            ticker = await self._queue.get()
+            try:
+                self._set(ticker, "loading")
+                frame = await client.daily(ticker)
+                # the database writes block, so they run on the loop's thread pool instead of stalling the downloads
+                await self._loop.run_in_executor(None, self.load, ticker, frame)
+                self._set(ticker, "done")
+            except Exception as e:
+                self.errors[ticker] = e
+                self._set(ticker, "failed")
+                print(f"{ticker}: onboarding failed ({e})")
+            finally:
+                self._queue.task_done()
+
+    def _set(self, ticker, state):
+        with self._lock:
+            self.status[ticker] = state
+
+    def submit(self, ticker):
+        """
+        Queues a ticker and returns straight away
+        A ticker already queued or loading is not queued twice
+        Returns the ticker's state
+        """
+        with self._lock:
+            state = self.status.get(ticker)
+            if state in ("queued", "loading"):
+                return state
+            self.status[ticker] = "queued"
+            self.errors.pop(ticker, None)
+            # queued while holding the lock so a thread that just failed cannot close its loop in between
+            self._start()
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, ticker)
+        return "queued"
+
+    def state(self, ticker):
+        """State of a submitted ticker, None when it was never submitted"""
+        with self._lock:
+            return self.status.get(ticker)
+
+    def join(self, timeout=None):
+        """Waits until every queued ticker was processed, for scripts and tests"""
+        with self._lock:
+            if self._thread is None:
+                return
+        asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop).result(timeout)
@@ -1,129 +1,351 @@
-import plotly.express as px
-import plotly.graph_objects as go
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
 import pandas as pd
-from flask import Flask, render_template, request
-import yfinance as yf
+from flask import Flask, Response, g, has_request_context, jsonify, render_template, request
+import indicators
+from alpha_vantage_client import InvalidSymbol, OnboardingQueue
 from data_warehouse_operations import DW_Stock
 from stock_metrics import StockMetrics
-import datetime
+from chart_cache import ChartCache
+from connection_pool import load_config
+from instrumentation import (CONTENT_TYPE, ERRORS, REQUEST_SECONDS, SLOW_REQUESTS, STAGE_SECONDS, Gauge,
+                             SamplingProfiler, render)
+import trading_calendar
+from storage_backends import get_backend
+from rollups import DEFAULT_MAX_POINTS, RESOLUTIONS, get_rollups
+from ticker_registry import get_registry
+
+# indicators calculated for the chart on the index page
+CHART_INDICATORS = ["SMA50", "SMA200", "EMA50", "EMA200"]
+
+# price columns the API can return
+PRICE_FIELDS = ["OpenPrice", "ClosePrice", "HighPrice", "LowPrice", "Volume"]
+
+# computed frames and encoded API payloads, dropped for a ticker whenever new rows are written for it
+chart_cache = ChartCache(max_bytes=load_config().getint("Web", "chart_cache_mb", fallback=64) * 1024 * 1024,
+                         ttl=load_config().getint("Web", "chart_cache_ttl", fallback=3600))
+_registry = None
+_onboarding = None
+
+logger = logging.getLogger(__name__)
+
+# requests slower than this are counted, and logged with the stacks they spent their time in when they were profiled
+SLOW_REQUEST_SECONDS = load_config().getfloat("Web", "slow_request_ms", fallback=1000) / 1000
+# fraction of requests the sampling profiler follows, 0 turns it off
+PROFILE_SAMPLE_RATE = load_config().getfloat("Web", "profile_sample_rate", fallback=0.0)
+
+Gauge("stock_chart_cache_bytes", "Memory held by the chart cache", function=lambda: chart_cache.size)
+Gauge("stock_chart_cache_entries", "Entries in the chart cache", function=lambda: len(chart_cache))
+Gauge("stock_chart_cache_hits", "Chart cache lookups answered from memory", function=lambda: chart_cache.hits)
+Gauge("stock_chart_cache_misses", "Chart cache lookups that had to be computed", function=lambda: chart_cache.misses)
+
+
+def registry():
+    """Ticker registry of the data warehouse, the chart cache is subscribed to its writes on first use"""
+    global _registry
+    if _registry is None:
+        _registry = get_registry(get_backend())
+        _registry.subscribe(chart_cache.invalidate)
+    return _registry
+
+
+def onboarding():
+    """Background queue downloading new tickers from Alpha Vantage, started on first use"""
+    global _onboarding
+    if _onboarding is None:
+        _onboarding = OnboardingQueue(lambda ticker, frame: DW_Stock().dw_load_history(ticker, frame),
+                                      workers=load_config().getint("Alpha Vantage", "onboarding_workers", fallback=2))
+    return _onboarding
+
+
+def stage(name):
+    """Times a stage of the current request eg. with stage("fetch"):"""
+    route = (request.endpoint or "unknown") if has_request_context() else "none"
+    return STAGE_SECONDS.time(route=route, stage=name)
+
 
 app = Flask(__name__)
+
+
+@app.before_request
+def start_request():
+    g.started = time.perf_counter()
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+
+@app.after_request
+def finish_request(response):
+    elapsed = time.perf_counter() - g.started
+    route = request.endpoint or "unknown"
+    REQUEST_SECONDS.observe(elapsed, route=route, status=response.status_code)
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+    if elapsed > SLOW_REQUEST_SECONDS:
+        SLOW_REQUESTS.inc(route=route)
+        if profiler is not None:
+            logger.warning("Slow request %s %s took %.0fms\n%s", request.method, request.full_path, elapsed * 1000,
+                           profiler.report())
+    return response
+
+
+@app.teardown_request
+def stop_profiler(error):
+    # requests that raised never reach finish_request
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+
+
+@app.route('/metrics')
+def metrics():
+    """Counters and latency histograms of the web application in the Prometheus text format"""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-        """Starting the web application"""
+        """Starting the web application, the chart itself is drawn in the browser from the /api/indicators data"""
         if request.method == 'POST':
-            ticker = request.form['ticker']
-            # returns stock data if avaialble None else
-            stock_data = fetch_stock_data(ticker)
+            ticker = request.form['ticker'].strip().upper()
             # starts the process to input new data into the datawarehouse
-            if stock_data is None:
-                datawarehouse = DW_Stock()
-                result = datawarehouse.dw_setup(ticker)
-                if result:
-                    # collecting the stock information from the data warehouse
-                    stock_data = fetch_stock_data(ticker)
-
-            # Assuming there is no stock information available generate the graph for the web application
-            if stock_data is not None:
-                #
-                fig = plot_stock_graph(stock_data, ticker)
-                graph_html = fig.to_html(full_html=False)
-                return render_template('index.html', graph_html=graph_html)
-            else:
-                return render_template('index.html', error="Invalid stock symbol or data not found.")
-
-        return render_template('index.html', graph_html=None)
-
-def fetch_stock_data(ticker):
-    """ Getting the stock from the data warehouse and formatting it to include additional stock information """
+            if not registry().contains(ticker):
+                # the history is downloaded in the background, the page polls /api/onboarding until it is loaded
+                onboarding().submit(ticker)
+                with stage("render"):
+                    return render_template('index.html', ticker=ticker, indicators=CHART_INDICATORS, pending=True)
+
+            with stage("render"):
+                return render_template('index.html', ticker=ticker, indicators=CHART_INDICATORS)
+
+        return render_template('index.html', ticker=None)
+
+
+@app.route('/api/onboarding/<ticker>')
+def api_onboarding(ticker):
+    """
+    Progress of a ticker submitted on the index page
+    state: "queued", "loading", "done" or "failed", "done" also covers tickers that were already in the warehouse
+    """
+    ticker = ticker.strip().upper()
+    state = onboarding().state(ticker)
+    if state is None and registry().contains(ticker):
+        state = "done"
+    if state is None:
+        return _api_error(404, f"{ticker} was not submitted")
+    payload = {"ticker": ticker, "state": state}
+    if state == "failed":
+        error = onboarding().errors.get(ticker)
+        payload["error"] = ("Invalid stock symbol or data not found." if isinstance(error, InvalidSymbol)
+                            else "The stock data could not be downloaded, try again later.")
+    return jsonify(payload)
+
+
+@app.route('/api/prices/<ticker>')
+def api_prices(ticker):
+    """
+    Daily prices of a ticker as columns
+    start, end: optional ISO dates, defaults to the last year
+    fields: optional comma separated price columns, defaults to all of them
+    """
+    return _api_response(ticker, [], "prices")
+
+
+@app.route('/api/indicators/<ticker>')
+def api_indicators(ticker):
+    """
+    Indicators of a ticker as columns aligned with the dates
+    names: comma separated indicators eg. SMA50,EMA200,RSI14,BB20, defaults to the ones on the index page
+    start, end: optional ISO dates, defaults to the last year
+    fields: optional comma separated price columns to include, defaults to ClosePrice
+    """
+    names = request.args.get('names')
+    names = [name.strip().upper() for name in names.split(',') if name.strip()] if names else CHART_INDICATORS
+    try:
+        for name in names:
+            indicators.parse_indicator(name)
+    except ValueError as e:
+        return _api_error(400, str(e))
+    return _api_response(ticker, names, "indicators", default_fields=["ClosePrice"])
+
+
+def _api_error(status, message):
+    """JSON error body for the API routes"""
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def _api_range(default_fields=None):
+    """
+    Dates and price columns asked for by an API request
+    Returns (start, end, fields, None), or (None, None, None, error response) when the arguments are invalid
+    """
+    try:
+        end = datetime.date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.date.today()
+        start = datetime.date.fromisoformat(request.args['start']) if 'start' in request.args else end - datetime.timedelta(days=365)
+    except ValueError:
+        return None, None, None, _api_error(400, "start and end must be dates formatted as YYYY-MM-DD")
+    if start > end:
+        return None, None, None, _api_error(400, "start must not be after end")
+    fields = request.args.get('fields')
+    fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else (default_fields or PRICE_FIELDS)
+    unknown = [field for field in fields if field not in PRICE_FIELDS]
+    if unknown:
+        return None, None, None, _api_error(400, f"Unknown fields: {', '.join(unknown)}")
+    return start, end, fields, None
+
+
+def _json_columns(df, columns):
+    """Columns of a frame as JSON lists, NaN is not valid JSON so the warm up period of an indicator is sent as null"""
+    result = {'Date': [day.isoformat() for day in pd.to_datetime(df['Date']).dt.date]}
+    for column in columns:
+        values = df[column].astype(float).round(4)
+        result[column] = [None if value != value else value for value in values.tolist()]
+    return result
+
+
+def _encode(payload):
+    """Encoded body, gzipped body and ETag of a payload, the form kept in the chart cache"""
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    return body, gzip.compress(body, compresslevel=6), hashlib.sha1(body).hexdigest()
+
+
+def _json_response(cached):
+    """Response for an encoded payload, a 304 when the client holds the same ETag and gzipped when it accepts it"""
+    body, compressed, etag = cached
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.make_conditional(request)
+    if response.status_code == 200 and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _api_response(ticker, indicator_names, kind, default_fields=None):
+    """
+    Builds the columnar JSON payload shared by the API routes
+    The encoded body is cached with its ETag so repeated polls cost a dictionary lookup and clients that already
+    hold the data get a 304 back
+    """
+    ticker = ticker.strip().upper()
+    if not registry().contains(ticker):
+        return _api_error(404, f"{ticker} is not in the data warehouse")
+    start, end, fields, error = _api_range(default_fields)
+    if error is not None:
+        return error
+
+    key = (ticker, trading_calendar.last_completed_session(), tuple(indicator_names), kind, start, end, tuple(fields))
+    cached = chart_cache.get(key)
+    if cached is None:
+        try:
+            df = fetch_stock_data(ticker, indicator_names, start, end)
+        except Exception:
+            logger.exception("Fetching the stock data of %s failed", ticker)
+            ERRORS.inc(component="fetch_stock_data")
+            return _api_error(500, "The stock data could not be loaded")
+        if df is None:
+            df = pd.DataFrame(columns=['Date'] + PRICE_FIELDS)
+        with stage("serialize"):
+            columns = _json_columns(df, fields + [column for column in df.columns if column not in ['Date'] + PRICE_FIELDS])
+            cached = _encode({"ticker": ticker, "start": start.isoformat(), "end": end.isoformat(), "columns": columns})
+        chart_cache.put(key, cached)
+    return _json_response(cached)
+
+
+@app.route('/api/history/<ticker>')
+def api_history(ticker):
+    """
+    Prices of a ticker over any range, read at the finest resolution that fits in max_points
+    start, end: optional ISO dates, defaults to the last year
+    max_points: optional most points returned, defaults to 1000, ranges too long even for monthly bars are thinned with LTTB
+    resolution: optional daily, weekly or monthly to override the choice
+    fields: optional comma separated price columns, defaults to all of them
+    Weekly and monthly rows are dated by the first day of the period and carry its last trading day in PeriodEnd
+    """
+    ticker = ticker.strip().upper()
+    if not registry().contains(ticker):
+        return _api_error(404, f"{ticker} is not in the data warehouse")
+    start, end, fields, error = _api_range()
+    if error is not None:
+        return error
     try:
-        # stock = yf.Ticker(ticker)
-        # data = stock.history(period="1y")
-        data_warehouse_stock = DW_Stock()
-        #check if the stock is in the data warehouse
-        check = data_warehouse_stock.dw_check_stock(ticker)
-        if not check:
-            return None
-        # gets data from the data warehouse within a year
-        data = data_warehouse_stock.dw_std_query(ticker)
-        # adding addition stock metrics
-        metrics = StockMetrics()
-        today = datetime.date.today()
-        start_date50 = datetime.date.today() - datetime.timedelta(days=415)
-        start_date200 = datetime.date.today() - datetime.timedelta(days=565)
-        year_date = datetime.date.today() - datetime.timedelta(days=365)
-
-        close, c_date, SMA50, _ = metrics.simple_moving_average(ticker, start_date50, today, 50)
-        _, _, SMA200, _ = metrics.simple_moving_average(ticker, start_date200, today, 200)
-        _, _, EMA50 = metrics.exponentail_moving_average(ticker,year_date, today, 50)
-        _, _, EMA200 = metrics.exponentail_moving_average(ticker, year_date, today, 200)
-
-        # converting metrics to dataframe
-        # filling in the missing values that for SMA and EMA to match with the close and date
-        adjusted_SMA50 = ([0] * (len(close) - len(SMA50))) + SMA50
-        adjusted_SMA200 = ([0] * (len(close) - len(SMA200))) + SMA200
-        adjusted_EMA50 = ([0] * (len(close) - len(EMA50))) + EMA50
-        adjusted_EMA200 = ([0] * (len(close) - len(EMA200))) + EMA200
-
-        df2 = pd.DataFrame(close, columns=['Close'])
-        df2.index = c_date
-        # adding the other metrics
-        df2["SMA50"] = adjusted_SMA50
-        df2["SMA200"] = adjusted_SMA200
-        df2["EMA50"] = adjusted_EMA50
-        df2["EMA200"] = adjusted_EMA200
-
-        # need to convert data to dataframe
-        df = pd.DataFrame.from_records(data=data, columns=['StockID', 'TickerSymbol', 'Date', 'OpenPrice', 
-                                                           'ClosePrice', 'Highprice', 'LowPrice', 'Volume'])
-        df['SMA50'] = df['ClosePrice'].rolling(window=50).mean()
-        df['EMA50'] = df['ClosePrice'].ewm(span=50, adjust=False).mean()
+        max_points = int(request.args.get('max_points', DEFAULT_MAX_POINTS))
+    except ValueError:
+        return _api_error(400, "max_points must be a whole number")
+    if max_points < 2:
+        return _api_error(400, "max_points must be at least 2")
+    resolution = request.args.get('resolution', '').strip().lower() or None
+    if resolution is not None and resolution not in RESOLUTIONS:
+        return _api_error(400, f"resolution must be one of {', '.join(RESOLUTIONS)}")
 
+    key = (ticker, trading_calendar.last_completed_session(), "history", start, end, max_points, resolution, tuple(fields))
+    cached = chart_cache.get(key)
+    if cached is None:
+        try:
+            with stage("fetch"):
+                chosen, downsampled, df = get_rollups(get_backend()).query(ticker, start, end, max_points, resolution)
+        except Exception:
+            logger.exception("Fetching the price history of %s failed", ticker)
+            ERRORS.inc(component="history")
+            return _api_error(500, "The stock data could not be loaded")
+        with stage("serialize"):
+            columns = _json_columns(df, fields)
+            if chosen != "daily":
+                columns['PeriodEnd'] = [day.isoformat() for day in pd.to_datetime(df['PeriodEnd']).dt.date]
+            cached = _encode({"ticker": ticker, "start": start.isoformat(), "end": end.isoformat(), "resolution": chosen,
+                              "downsampled": downsampled, "columns": columns})
+        chart_cache.put(key, cached)
+    return _json_response(cached)
+
+
+def fetch_stock_data(ticker, indicator_names=CHART_INDICATORS, start=None, end=None):
+    """
+    Getting the stock from the data warehouse and formatting it to include additional stock information
+    ticker: ticker name eg "AAPL"
+    indicator_names: indicators added as columns
+    start, end: dates returned, defaults to the last year
+    Returns None when the stock or the dates are not in the data warehouse, database errors are raised to the caller
+    """
+    # check if the stock is in the data warehouse, answered from memory without touching the database
+    if not registry().contains(ticker):
+        return None
+    if end is None:
+        end = datetime.date.today()
+    if start is None:
+        start = end - datetime.timedelta(days=365)
+    key = (ticker, trading_calendar.last_completed_session(), tuple(indicator_names), "frame", start, end)
+    df = chart_cache.get(key)
+    if df is not None:
         return df
-    except Exception as e:
-        print(f"Error fetching stock data: {e}")
+    metrics = StockMetrics()
+    # indicators precomputed by indicator_job.py are read as they are when the table is up to date
+    with stage("fetch"):
+        df = metrics.materialized_frame(ticker, indicator_names, days=(end - start).days, end_date=end)
+        if df is None:
+            # a single query covers the dates shown plus the history the indicators need to warm up
+            prices = metrics.price_frame(ticker, start - datetime.timedelta(days=indicators.lookback_days(indicator_names)), end)
+    if df is None:
+        with stage("compute"):
+            df = metrics.add_indicators(prices, indicator_names, start)
+    # nothing in the range, the missing days have to be synced first
+    if df.empty:
         return None
 
+    chart_cache.put(key, df)
+    return df
 
-def plot_stock_graph(stock_data, ticker):
-    """ Creates a plotly figure that can be displayed on the web application as a interactive figure """
-    # px.line takes dataframe, the x and y are the dataframe columns link below for reference
-    fig = px.line(stock_data, x='Date', y="ClosePrice", title=f"Stock Price Over Time:  {ticker}")
-    fig = go.Figure()
-    # adds the closing price to the graph
-    fig.add_trace(
-        go.Scatter(
-            x= stock_data['Date'],
-            y= stock_data['ClosePrice'],
-            mode="lines",
-            name = 'Closing Price',
-            showlegend=True
-            )
-        )
-    # Adds the simple moving average for 50 days to the graph
-    fig.add_trace(
-        go.Scatter(
-            x = stock_data['Date'],
-            y = stock_data['SMA50'],
-            mode = "lines",
-            line=go.scatter.Line(color='red'),
-            name='Simple Moving Average(50)'
-            )
-        )
-    # Addes the exponential moving average for 50 days to the graph
-    fig.add_trace(
-        go.Scatter(
-            x = stock_data['Date'],
-            y = stock_data['EMA50'],
-            mode = "lines",
-            line=go.scatter.Line(color='green'),
-            name='Exponential Moving Average(50)'
-            )
-        )
-    fig.update_xaxes(title="Date")
-    fig.update_yaxes(title="Price (USD)")
-
-    return fig
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     app.run()
@@ -0,0 +1,254 @@
+# The purpose of this file is to check how the indicator based trading rules would have done on the warehouse history
+# Closing prices are loaded once as a date x ticker matrix and every strategy turns it into a matrix of positions with
+# array operations, so a whole history is evaluated without a loop over the days. Parameter sweeps spread the
+# combinations over a pool of worker processes that each receive the prices once.
+
+import datetime
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import indicators
+from cross_section import CrossSection
+
+# trading days in a year, used to annualize returns and volatility
+TRADING_DAYS = 252
+
+
+def _held(enter, leave):
+    """
+    Positions from entry and exit signals, 1 from an entry until the next exit
+    enter, leave: boolean matrices, an exit on the same day as an entry wins
+    """
+    # the last signal seen decides the position, carried forward in compiled code instead of a loop over the days
+    signal = np.where(leave, 0.0, np.where(enter, 1.0, np.nan))
+    return pd.DataFrame(signal).ffill().fillna(0.0).to_numpy()
+
+
+def _average(closes, name):
+    """SMA or EMA named like "SMA50" """
+    kind, window = indicators.parse_indicator(name)
+    # each stock's average starts from its own first price
+    if kind == "SMA":
+        return indicators.from_first_value(indicators.sma, closes, window)
+    if kind == "EMA":
+        return indicators.from_first_value(indicators.ema, closes, window)
+    raise ValueError(f"{name} is not a moving average")
+
+
+def crossover(closes, fast="SMA50", slow="SMA200"):
+    """
+    Long while the fast moving average is above the slow one
+    closes: closing prices, one row per date and one column per ticker
+    fast, slow: moving averages eg. "SMA50" or "EMA20"
+    """
+    with np.errstate(invalid="ignore"):
+        return (_average(closes, fast) > _average(closes, slow)).astype(np.float64)
+
+
+def rsi_threshold(closes, period=14, lower=30, upper=70):
+    """
+    Buys when the RSI falls below lower and sells when it rises above upper
+    period: RSI period
+    lower, upper: oversold and overbought levels
+    """
+    strength = indicators.from_first_value(indicators.rsi, closes, period)
+    with np.errstate(invalid="ignore"):
+        return _held(strength < lower, strength > upper)
+
+
+def bollinger_breakout(closes, window=20, num_std=2):
+    """
+    Buys when the close breaks above the upper band and sells when it falls back below the middle band
+    window: moving average window of the bands
+    num_std: distance of the bands in standard deviations
+    """
+    upper, middle, _ = indicators.from_first_value(indicators.bollinger_bands, closes, window, num_std)
+    with np.errstate(invalid="ignore"):
+        return _held(closes > upper, closes < middle)
+
+
+# strategies by the name used in run and sweep
+STRATEGIES = {
+    "crossover": crossover,
+    "rsi_threshold": rsi_threshold,
+    "bollinger_breakout": bollinger_breakout,
+}
+
+
+def simulate(closes, positions, cost=0.0):
+    """
+    Daily returns of holding the positions
+    closes: closing prices, one row per date and one column per ticker
+    positions: fraction held at each close, decided on that close and earning the next day's return
+    cost: fraction of the price paid on every change of position
+    Returns the daily strategy returns with the same shape as closes
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily = np.diff(closes, axis=0) / closes[:-1]
+    # days before a stock's first price earn nothing
+    daily = np.nan_to_num(daily, nan=0.0, posinf=0.0, neginf=0.0)
+    held = positions[:-1]
+    turnover = np.abs(np.diff(positions, axis=0, prepend=np.zeros((1,) + positions.shape[1:])))[:-1]
+    returns = np.zeros(closes.shape)
+    returns[1:] = held * daily - cost * turnover
+    return returns
+
+
+def summarize(returns, positions):
+    """
+    Performance figures of every column of daily strategy returns
+    Returns a dict of figure name to array with one value per ticker
+    """
+    equity = np.cumprod(1 + returns, axis=0)
+    peaks = np.maximum.accumulate(equity, axis=0)
+    years = max(len(returns) - 1, 1) / TRADING_DAYS
+    volatility = returns[1:].std(axis=0) * np.sqrt(TRADING_DAYS)
+    mean = returns[1:].mean(axis=0) * TRADING_DAYS if len(returns) > 1 else np.zeros(returns.shape[1:])
+    entries = (np.diff(positions, axis=0, prepend=np.zeros((1,) + positions.shape[1:])) > 0).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "TotalReturn": equity[-1] - 1,
+            "AnnualReturn": equity[-1] ** (1 / years) - 1,
+            "Volatility": volatility,
+            "Sharpe": np.where(volatility > 0, mean / volatility, np.nan),
+            "MaxDrawdown": (equity / peaks - 1).min(axis=0),
+            "Trades": entries,
+            "Exposure": positions.mean(axis=0),
+        }
+
+
+def trade_list(dates, tickers, closes, positions):
+    """
+    Every round trip made by the strategy
+    Returns a DataFrame with one row per trade, a position still open at the end is closed on the last date
+    """
+    trades = []
+    for column, ticker in enumerate(tickers):
+        held = positions[:, column] > 0
+        changes = np.diff(held.astype(np.int8), prepend=0, append=0)
+        # entries are bought on the signal's close, exits sold on the close the signal ends
+        for start, stop in zip(np.flatnonzero(changes == 1), np.flatnonzero(changes == -1)):
+            stop = min(stop, len(dates) - 1)
+            trades.append((ticker, dates[start], closes[start, column], dates[stop], closes[stop, column], stop - start))
+    df = pd.DataFrame(trades, columns=["TickerSymbol", "EntryDate", "EntryPrice", "ExitDate", "ExitPrice", "Days"])
+    df["Return"] = df["ExitPrice"] / df["EntryPrice"] - 1
+    return df
+
+
+def evaluate(closes, strategy, cost=0.0, **params):
+    """
+    Runs one strategy over a price matrix
+    Returns the positions, the daily returns and the summary figures
+    """
+    positions = STRATEGIES[strategy](closes, **params)
+    # nothing is held before a stock has a price
+    positions = np.where(np.isfinite(closes), positions, 0.0)
+    returns = simulate(closes, positions, cost)
+    return positions, returns, summarize(returns, positions)
+
+
+_worker_closes = None
+
+
+def _init_worker(closes):
+    """Runs once in each worker process so the prices are sent once rather than with every combination"""
+    global _worker_closes
+    _worker_closes = closes
+
+
+def _mean(values):
+    """Average over the tickers, NaN when no ticker has the figure eg. the Sharpe ratio of a strategy that never traded"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    return float(values.mean()) if len(values) else float("nan")
+
+
+def _evaluate_combinations(strategy, cost, combinations):
+    """Summary figures averaged over the tickers for a batch of parameter combinations"""
+    results = []
+    for params in combinations:
+        try:
+            _, _, summary = evaluate(_worker_closes, strategy, cost, **params)
+        except ValueError:
+            # combinations the strategy rejects, such as a window below 1, are skipped rather than failing the sweep
+            continue
+        results.append(dict(params, **{name: _mean(values) for name, values in summary.items()}))
+    return results
+
+
+class Backtest:
+    def __init__(self, backend=None):
+        """
+        backend: storage backend holding the warehouse, defaults to the one in the configuration file
+        """
+        self.universe = CrossSection(backend)
+
+    def prices(self, tickers, start_date, end_date):
+        """Closing prices as (dates, tickers, matrix) with one column per ticker"""
+        return self.universe.price_matrix(start_date, end_date, tickers)
+
+    def run(self, strategy, tickers, start_date, end_date=None, cost=0.0, **params):
+        """
+        Replays the history of one or more tickers through a strategy
+        strategy: name in STRATEGIES eg. "crossover"
+        tickers: ticker name or list of tickers eg. ["AAPL", "MSFT"]
+        start_date, end_date: dates replayed, end_date defaults to today
+        cost: fraction of the price paid on every change of position
+        params: strategy parameters eg. fast="EMA20", slow="SMA100"
+        Returns a dict with the summary per ticker, the daily equity curves and the trades
+        """
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        dates, tickers, closes = self.prices(tickers, start_date, end_date or datetime.date.today())
+        positions, returns, summary = evaluate(closes, strategy, cost, **params)
+        return {
+            "summary": pd.DataFrame(summary, index=pd.Index(tickers, name="TickerSymbol")),
+            "equity": pd.DataFrame(np.cumprod(1 + returns, axis=0), index=pd.Index(dates, name="Date"), columns=tickers),
+            "trades": trade_list(dates, tickers, closes, positions),
+        }
+
+    def sweep(self, strategy, grid, tickers, start_date, end_date=None, cost=0.0, workers=None):
+        """
+        Runs a strategy for every combination of parameters on a pool of worker processes
+        strategy: name in STRATEGIES eg. "crossover"
+        grid: dict of parameter name to the values tried eg. {"fast": ["SMA20", "SMA50"], "slow": ["SMA100", "SMA200"]}
+        tickers: ticker name or list of tickers, the figures are averaged over them
+        start_date, end_date: dates replayed, end_date defaults to today
+        cost: fraction of the price paid on every change of position
+        workers: number of worker processes, defaults to one per CPU
+        Returns a DataFrame with one row per combination ordered by Sharpe ratio
+        """
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        started = time.perf_counter()
+        _, _, closes = self.prices(tickers, start_date, end_date or datetime.date.today())
+        combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+        workers = workers or os.cpu_count() or 1
+        # a few batches per worker keeps them all busy without paying for a round trip per combination
+        size = max(1, len(combinations) // (workers * 4))
+        batches = [combinations[i:i + size] for i in range(0, len(combinations), size)]
+
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(closes,)) as executor:
+            for batch in executor.map(_evaluate_combinations, itertools.repeat(strategy), itertools.repeat(cost), batches):
+                results.extend(batch)
+
+        elapsed = time.perf_counter() - started
+        print(f"Swept {len(combinations)} combinations of {strategy} over {len(tickers)} stocks in {elapsed:.2f}s")
+        columns = list(grid) + ["TotalReturn", "AnnualReturn", "Volatility", "Sharpe", "MaxDrawdown", "Trades", "Exposure"]
+        return pd.DataFrame(results, columns=columns).sort_values("Sharpe", ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    backtest = Backtest()
+    result = backtest.run("crossover", "AAPL", datetime.date(2015, 1, 1), fast="SMA50", slow="SMA200")
+    print(result["summary"])
+    print(result["trades"].tail())
+    print(backtest.sweep("crossover", {"fast": [f"SMA{w}" for w in range(10, 60, 5)],
+                                       "slow": [f"SMA{w}" for w in range(100, 250, 10)]},
+                         "AAPL", datetime.date(2005, 1, 1)).head(10))
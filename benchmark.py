@@ -0,0 +1,276 @@
+# The purpose of this file is to time the hot paths of the data warehouse on synthetic data so slowdowns show up between versions
+# A synthetic price history is generated for a configurable number of tickers and days and loaded into a local SQLite or
+# DuckDB warehouse, then ingest, the daily update, the standard query, every StockMetrics indicator and the web routes
+# are timed. Latency percentiles, throughput and peak memory are written to a JSON file, and a previous file can be
+# passed with --compare to fail the run when a path got slower.
+# eg. python benchmark.py --tickers 50 --days 2520 --output before.json
+#     python benchmark.py --tickers 50 --days 2520 --compare before.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import connection_pool
+import trading_calendar
+
+PERCENTILES = [50, 90, 99]
+
+
+def synthetic_prices(tickers, days, end=None, seed=0):
+    """
+    Random walk daily prices on the NYSE calendar
+    tickers: number of tickers, named SYN0000, SYN0001, ...
+    days: trading days of history per ticker
+    end: last date generated, defaults to the session before the one dw_update fetches
+    seed: random seed so runs are comparable
+    Returns a dict of ticker to DataFrame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns
+    """
+    if end is None:
+        end = trading_calendar.previous_trading_day(trading_calendar.previous_trading_day(datetime.date.today()))
+    dates = pd.date_range(end=end, periods=days, freq=trading_calendar.TRADING_DAY)
+    rng = np.random.default_rng(seed)
+    # geometric random walk with a little drift, one column per ticker
+    closes = 20 * np.exp(rng.uniform(0, 3, tickers) + np.cumsum(rng.normal(0.0003, 0.02, (days, tickers)), axis=0))
+    opens = closes * np.exp(rng.normal(0, 0.005, (days, tickers)))
+    highs = np.maximum(opens, closes) * (1 + rng.uniform(0, 0.01, (days, tickers)))
+    lows = np.minimum(opens, closes) * (1 - rng.uniform(0, 0.01, (days, tickers)))
+    volumes = rng.integers(100_000, 10_000_000, (days, tickers))
+    return {
+        f"SYN{k:04d}": pd.DataFrame({
+            "Date": dates, "OpenPrice": opens[:, k], "ClosePrice": closes[:, k], "HighPrice": highs[:, k],
+            "LowPrice": lows[:, k], "Volume": volumes[:, k],
+        })
+        for k in range(tickers)
+    }
+
+
+def timed(function, repeat=20, warmup=2, items=1):
+    """
+    Times a function and measures the memory it allocates
+    function: function with no arguments
+    repeat: timed calls
+    warmup: untimed calls made first so caches and connections are set up
+    items: units of work per call eg. rows, used for the throughput
+    Returns a dict of figures, latencies in milliseconds and peak memory in bytes
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    # tracemalloc slows everything down, so the memory is measured on a separate call
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples = np.array(samples) * 1000
+    figures = {f"p{p}_ms": float(np.percentile(samples, p)) for p in PERCENTILES}
+    figures.update({
+        "mean_ms": float(samples.mean()),
+        "min_ms": float(samples.min()),
+        "max_ms": float(samples.max()),
+        "calls": repeat,
+        "throughput_per_s": float(items * 1000 / samples.mean()),
+        "peak_memory_bytes": int(peak),
+    })
+    return figures
+
+
+def _write_config(workdir, backend):
+    """Configuration file for a local warehouse in the work directory"""
+    suffix = "duckdb" if backend == "duckdb" else "db"
+    path = os.path.join(workdir, "benchmark.ini")
+    with open(path, "w") as f:
+        f.write(f"""[Alpha Vantage]
+api_key = benchmark
+
+[Data Warehouse]
+backend = {backend}
+path = {os.path.join(workdir, f"warehouse.{suffix}")}
+bulk_batch_size = 5000
+update_workers = 4
+update_chunk_size = 50
+update_retries = 0
+
+[Web]
+chart_cache_mb = 64
+""")
+    return path
+
+
+def run(tickers=20, days=2520, backend="sqlite", repeat=20, workdir=None, seed=0):
+    """
+    Builds a synthetic warehouse and times every hot path on it
+    tickers: number of synthetic tickers
+    days: trading days of history per ticker
+    backend: "sqlite" or "duckdb"
+    repeat: timed calls per measurement
+    workdir: directory for the warehouse and configuration file, defaults to a new temporary directory
+    Returns the results as a dict ready to be written as JSON
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="stock_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    connection_pool.use_config(_write_config(workdir, backend))
+    # imported after the configuration is in place, app builds its caches from it at import time
+    import app as web
+    from data_warehouse_operations import DW_Stock
+    from stock_metrics import StockMetrics
+
+    frames = synthetic_prices(tickers, days, seed=seed)
+    symbols = list(frames)
+    session = trading_calendar.previous_trading_day(datetime.date.today())
+
+    class SyntheticDW(DW_Stock):
+        """DW_Stock whose downloads return one synthetic row per ticker instead of calling yfinance"""
+        def _download(self, tickers, start, end):
+            result = {}
+            for ticker in tickers:
+                last = frames[ticker].iloc[-1]
+                result[ticker] = pd.DataFrame({
+                    "Date": [pd.Timestamp(session)], "OpenPrice": [last["ClosePrice"]],
+                    "ClosePrice": [last["ClosePrice"] * 1.01], "HighPrice": [last["ClosePrice"] * 1.02],
+                    "LowPrice": [last["ClosePrice"] * 0.99], "Volume": [int(last["Volume"])],
+                })
+            return result
+
+    dw = SyntheticDW()
+    metrics = StockMetrics()
+    results = {}
+    rng = np.random.default_rng(seed)
+
+    # ingest, the write half of dw_setup since the download itself depends on Alpha Vantage
+    started = time.perf_counter()
+    latencies = []
+    for ticker, frame in frames.items():
+        ticker_started = time.perf_counter()
+        dw.dw_load_history(ticker, frame)
+        latencies.append(time.perf_counter() - ticker_started)
+    elapsed = time.perf_counter() - started
+    # loading a ticker again overwrites the same rows, so the memory of one load is measured on a repeat
+    tracemalloc.start()
+    dw.dw_load_history(symbols[0], frames[symbols[0]])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = np.array(latencies) * 1000
+    results["dw_setup_ingest"] = {f"p{p}_ms": float(np.percentile(latencies, p)) for p in PERCENTILES}
+    results["dw_setup_ingest"].update({
+        "total_s": elapsed, "rows": tickers * days, "throughput_per_s": tickers * days / elapsed,
+        "peak_memory_bytes": int(peak),
+    })
+
+    results["dw_update"] = timed(lambda: dw.dw_update(), repeat=max(1, repeat // 5), warmup=1, items=tickers)
+
+    def pick():
+        return symbols[rng.integers(len(symbols))]
+
+    end = session
+    start = end - datetime.timedelta(days=365)
+    results["dw_std_query"] = timed(lambda: dw.dw_std_query(pick()), repeat)
+    results["dw_history_query"] = timed(lambda: dw.dw_history_query(pick(), end - datetime.timedelta(days=days * 365 // 252), end), repeat)
+    results["simple_moving_average"] = timed(lambda: metrics.simple_moving_average(pick(), start, end, 50), repeat)
+    results["exponentail_moving_average"] = timed(lambda: metrics.exponentail_moving_average(pick(), start, end, 50), repeat)
+    results["reletive_strength_index"] = timed(lambda: metrics.reletive_strength_index(pick(), start, end), repeat)
+    results["bollinger_bands"] = timed(lambda: metrics.bollinger_bands(pick(), start, end), repeat)
+    results["indicator_frame"] = timed(lambda: metrics.indicator_frame(pick(), web.CHART_INDICATORS, end_date=end), repeat)
+
+    # the index page followed by the chart data request the page makes
+    client = web.app.test_client()
+    names = ",".join(web.CHART_INDICATORS)
+
+    def page(cold):
+        ticker = pick()
+        if cold:
+            web.chart_cache.clear()
+        client.post("/", data={"ticker": ticker})
+        response = client.get(f"/api/indicators/{ticker}?names={names}&fields=ClosePrice")
+        assert response.status_code == 200, response.status_code
+
+    results["index_route_cold"] = timed(lambda: page(True), repeat)
+    results["index_route_warm"] = timed(lambda: page(False), repeat)
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": {"tickers": tickers, "days": days, "backend": backend, "repeat": repeat, "seed": seed},
+        "results": results,
+    }
+
+
+def _commit():
+    """Current git commit, None outside a checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance=1.25):
+    """
+    Finds the paths that got slower than a previous run
+    current, baseline: results returned by run
+    tolerance: ratio of the median latencies above which a path counts as a regression
+    Returns a list of (path, baseline p50, current p50, ratio) for the regressions
+    """
+    regressions = []
+    for name, figures in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None or not before.get("p50_ms"):
+            continue
+        ratio = figures["p50_ms"] / before["p50_ms"]
+        if ratio > tolerance:
+            regressions.append((name, before["p50_ms"], figures["p50_ms"], ratio))
+    return regressions
+
+
+def report(results):
+    """Prints one line per measured path"""
+    print(f"{'path':<28}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'per s':>12}{'peak MB':>10}")
+    for name, figures in results["results"].items():
+        print(f"{name:<28}{figures['p50_ms']:>10.2f}{figures['p90_ms']:>10.2f}{figures['p99_ms']:>10.2f}"
+              f"{figures['throughput_per_s']:>12.1f}{figures['peak_memory_bytes'] / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the data warehouse hot paths on synthetic data")
+    parser.add_argument("--tickers", type=int, default=20, help="number of synthetic tickers")
+    parser.add_argument("--days", type=int, default=2520, help="trading days of history per ticker")
+    parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="sqlite", help="local warehouse engine")
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per path")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic data")
+    parser.add_argument("--workdir", help="directory for the warehouse, defaults to a temporary directory")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="previous results file, the run fails when a path got slower")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    results = run(args.tickers, args.days, args.backend, args.repeat, args.workdir, args.seed)
+    report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != results["parameters"]:
+            print(f"Warning: {args.compare} was run with {baseline.get('parameters')}, the timings may not be comparable")
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {before:.2f}ms -> {after:.2f}ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,96 @@
+# The purpose of this file is to keep recently computed stock frames and encoded API payloads in memory
+# Prices change at most once per trading day so an entry keyed by (ticker, as of date, indicators) can be served again
+# without touching the database. Entries for a ticker are dropped as soon as new rows for it are written.
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def _sizeof(value):
+    """Approximate memory held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ChartCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        """
+        Least recently used cache with a cap on the memory the entries hold
+        max_bytes: total size of the entries before the least recently used ones are evicted
+        ttl: seconds an entry is served for, a safety net for rows written by other processes
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached value or None
+        key: tuple starting with the ticker eg ("AAPL", as_of, ("SMA50",), "frame", start, end)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[2] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used entries until it fits"""
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # a value bigger than the whole cache would only evict everything else
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic())
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        """Drops one entry, the lock must already be held"""
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def invalidate(self, tickers):
+        """
+        Drops every entry for the given tickers
+        tickers: tickers that received new rows
+        """
+        tickers = set(tickers)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in tickers]:
+                self._remove(key)
+
+    def clear(self):
+        """Drops every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size(self):
+        """Bytes currently held"""
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,162 @@
+# The purpose of this file is to keep a small pool of database connections shared by DW_Stock, StockMetrics and the web application
+# so the cost of connecting to the data warehouse is paid once per process instead of once per request
+
+import configparser
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+CONFIG_PATH = r"configs\config.ini"
+
+_config = None
+
+
+def load_config():
+    """Reads the configuration file once and returns the same parser on later calls"""
+    global _config
+    if _config is None:
+        config = configparser.ConfigParser()
+        config.read(CONFIG_PATH)
+        _config = config
+    return _config
+
+
+def use_config(path):
+    """
+    Points the process at another configuration file, read on the next call to load_config
+    path: path of the configuration file eg. one written by benchmark.py for a local warehouse
+    """
+    global CONFIG_PATH, _config
+    CONFIG_PATH = path
+    _config = None
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, timeout=30, health_check="SELECT 1", check_interval=60):
+        """
+        Keeps up to size open connections and hands them out one at a time
+        connect: function with no arguments returning a new DB-API connection eg. pyodbc.connect or sqlite3.connect
+        size: maximum number of connections open at once
+        timeout: seconds to wait for a free connection before raising PoolTimeout
+        health_check: statement run on connections that have been idle for check_interval seconds, None to skip
+        check_interval: seconds a connection can sit idle before it is checked again
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self.check_interval = check_interval
+        # most recently returned connections are handed out first so idle ones can age out
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self.pid = os.getpid()
+
+    def _open(self):
+        """Opens a new connection counting it against the pool size"""
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot in the pool"""
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, idle_since):
+        """Runs the health check on connections that have been idle for a while"""
+        if self.health_check is None or time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.health_check)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        """Takes an idle connection, opens a new one if there is room or waits for one to be returned"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self._closed:
+                raise PoolTimeout("connection pool is closed")
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+                if can_open:
+                    return self._open()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"no connection available after {self.timeout} seconds")
+                try:
+                    conn, idle_since = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    raise PoolTimeout(f"no connection available after {self.timeout} seconds")
+            if self._healthy(conn, idle_since):
+                return conn
+            # the connection went stale, drop it and try again
+            self._discard(conn)
+
+    def _checkin(self, conn):
+        """Returns a connection to the pool, closing it if the pool has been shut down"""
+        if self._closed:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _reset(self, conn):
+        """Rolls back whatever the borrower left uncommitted, returns False if the connection is no longer usable"""
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            # some drivers refuse to roll back outside a transaction eg. DuckDB, the connection is fine if it still answers
+            return self._healthy(conn, float("-inf"))
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the duration of a with block
+        Any uncommitted work is rolled back before the connection is returned, commit inside the block to keep it
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if self._reset(conn):
+                self._checkin(conn)
+            else:
+                # the connection itself is broken, do not hand it out again
+                self._discard(conn)
+
+    def close(self):
+        """Closes every idle connection, connections still checked out are closed when they are returned"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
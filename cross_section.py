@@ -0,0 +1,246 @@
+# The purpose of this file is to answer questions across every stock in the warehouse at once
+# The universe is read with one query into a dense date x ticker matrix so correlations and screens are computed in bulk
+# with NumPy instead of one StockMetrics call per ticker.
+
+import datetime
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+import indicators
+from storage_backends import PRICE_COLUMNS, QUERY_CHUNK, get_backend
+from ticker_registry import get_registry
+
+# comparisons a screen condition can use eg. "RSI14 < 30"
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+CONDITION_PATTERN = re.compile(r"^\s*([\w.]+)\s*(<=|>=|<|>)\s*([\w.]+)\s*$")
+
+# names a condition can use for the closing price
+CLOSE_NAMES = {"CLOSE", "CLOSEPRICE"}
+
+# calendar days always read before the screened date so a weekend or holiday still finds the last session
+RECENT_DAYS = 14
+
+
+class CrossSection:
+    def __init__(self, backend=None):
+        """
+        backend: storage backend holding the warehouse, defaults to the one in the configuration file
+        """
+        self.backend = backend if backend is not None else get_backend()
+        self.pool = self.backend.pool
+
+    def price_matrix(self, start_date, end_date, tickers=None, field="ClosePrice"):
+        """
+        Loads one price column for the whole universe as a dense matrix
+        start_date, end_date: dates loaded, both ends included
+        tickers: tickers to load, defaults to every ticker in the registry
+        field: price column eg. "ClosePrice" or "Volume"
+        Returns the dates, the tickers and a float64 matrix with one row per date and one column per ticker.
+        Days a ticker did not trade are carried forward from its previous price, days before its first price are NaN
+        """
+        if field not in PRICE_COLUMNS[2:]:
+            raise ValueError(f"Unknown price column: {field}")
+        if tickers is None:
+            tickers = get_registry(self.backend).tickers()
+        tickers = list(dict.fromkeys(tickers))
+
+        results = []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(tickers), QUERY_CHUNK):
+                chunk = tickers[i:i + QUERY_CHUNK]
+                cursor.execute(self.backend.sql(f"""
+                    SELECT TickerSymbol, Date, {field}
+                    FROM {{StockInformation}} s
+                    WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol IN ({', '.join('?' * len(chunk))})
+                """), [start_date, end_date] + chunk)
+                results.extend(cursor.fetchall())
+
+        # one row per date any stock traded on so every ticker sits on the same calendar
+        symbols = np.array([row[0] for row in results], dtype=object)
+        days = pd.to_datetime(pd.Series([row[1] for row in results], dtype=object)).to_numpy()
+        values = np.fromiter((np.nan if row[2] is None else row[2] for row in results), dtype=np.float64, count=len(results))
+        dates = np.unique(days)
+        rows = np.searchsorted(dates, days)
+        columns = pd.Index(tickers).get_indexer(symbols)
+
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        matrix[rows, columns] = values
+        # a halted stock keeps its last price, pandas fills each column forward in compiled code
+        matrix = pd.DataFrame(matrix).ffill().to_numpy()
+        return pd.to_datetime(dates).date, tickers, matrix
+
+    def indicator_matrices(self, indicator_names, end_date=None, days=0, tickers=None):
+        """
+        Computes indicators for the whole universe
+        indicator_names: indicators eg. ["SMA200", "RSI14", "BB20"]
+        end_date: last date computed, defaults to today
+        days: calendar days before end_date that are returned, 0 returns only the last date with prices up to end_date
+        tickers: tickers to compute, defaults to every ticker in the registry
+        Returns the dates, the tickers and a dict of column name to matrix, the closing prices are under "ClosePrice"
+        """
+        if end_date is None:
+            end_date = datetime.date.today()
+        display_start = end_date - datetime.timedelta(days=days)
+        fetch_start = display_start - datetime.timedelta(days=max(indicators.lookback_days(indicator_names), RECENT_DAYS))
+        dates, tickers, closes = self.price_matrix(fetch_start, end_date, tickers)
+
+        columns = {"ClosePrice": closes}
+        columns.update({name: np.full(closes.shape, np.nan) for name in _column_names(indicator_names)})
+        if len(dates) == 0:
+            return dates, tickers, columns
+        # each ticker's indicators start from its own first price
+        columns.update(indicators.from_first_value(indicators.compute_indicators, closes, indicator_names))
+
+        if days == 0:
+            keep = np.array([len(dates) - 1])
+        else:
+            keep = np.flatnonzero(pd.to_datetime(dates) >= pd.Timestamp(display_start))
+        return dates[keep], tickers, {column: values[keep] for column, values in columns.items()}
+
+    def covariance_matrix(self, window=60, end_date=None, tickers=None, correlation=False):
+        """
+        Covariance of daily log returns between every pair of tickers over the last window trading days
+        window: number of daily returns used
+        end_date: last date of the window, defaults to today
+        tickers: tickers included, defaults to every ticker in the registry
+        correlation: return the correlation matrix instead
+        Returns a DataFrame indexed by ticker on both axes, tickers without a full window of prices are NaN
+        """
+        # two weeks of slack on top of roughly 252 trading days in 365 calendar days
+        start_date = (end_date or datetime.date.today()) - datetime.timedelta(days=int((window + 1) * 365 / 252) + 14)
+        dates, tickers, closes = self.price_matrix(start_date, end_date or datetime.date.today(), tickers)
+        returns = np.diff(np.log(closes[-(window + 1):]), axis=0)
+        return pd.DataFrame(_covariance(returns, correlation), index=tickers, columns=tickers)
+
+    def correlation_matrix(self, window=60, end_date=None, tickers=None):
+        """Correlation of daily log returns between every pair of tickers, see covariance_matrix"""
+        return self.covariance_matrix(window, end_date, tickers, correlation=True)
+
+    def rolling_correlation(self, window, start_date, end_date, tickers=None, correlation=True):
+        """
+        Correlation matrices over a window moving one trading day at a time
+        window: number of daily returns in each matrix
+        start_date, end_date: dates of the last day of the first and last window
+        tickers: tickers included, defaults to every ticker in the registry
+        correlation: False yields covariance matrices instead
+        Yields the date and a DataFrame for each window, the matrices are produced one at a time to keep memory flat
+        """
+        fetch_start = start_date - datetime.timedelta(days=int((window + 1) * 365 / 252) + 14)
+        dates, tickers, closes = self.price_matrix(fetch_start, end_date, tickers)
+        returns = np.diff(np.log(closes), axis=0)
+        first = int(np.searchsorted(pd.to_datetime(dates), pd.Timestamp(start_date)))
+        # row i of returns ends on dates[i + 1]
+        for end in range(max(first, window), len(dates)):
+            matrix = _covariance(returns[end - window:end], correlation)
+            yield dates[end], pd.DataFrame(matrix, index=tickers, columns=tickers)
+
+    def screen(self, conditions, as_of=None, tickers=None):
+        """
+        Finds the tickers meeting every condition on a date
+        conditions: list of comparisons eg. ["RSI14 < 30", "Close > SMA200"], each side is an indicator, Close or a number
+        as_of: date screened, defaults to the latest date in the warehouse up to today
+        tickers: tickers screened, defaults to every ticker in the registry
+        Returns a DataFrame with one row per matching ticker and the values the conditions used
+        """
+        parsed = [_parse_condition(condition) for condition in conditions]
+        # indicators to compute, a side like BB20_Lower computes BB20 and reads one of its columns
+        names = list(dict.fromkeys(side[0] for left, _, right in parsed for side in (left, right)
+                                   if isinstance(side, tuple) and side[0] is not None))
+        last_dates = get_registry(self.backend).entries(tickers)
+        if as_of is None:
+            latest = [pd.Timestamp(entry[1]).date() for entry in last_dates.values() if entry[1] is not None]
+            as_of = min(max(latest), datetime.date.today()) if latest else datetime.date.today()
+        dates, tickers, columns = self.indicator_matrices(names, end_date=as_of, tickers=tickers)
+        if len(dates) == 0:
+            return pd.DataFrame(columns=["TickerSymbol", "Date", "ClosePrice"] + _column_names(names))
+
+        def value(side):
+            return columns[side[1]][-1] if isinstance(side, tuple) else side
+
+        # NaN compares False so tickers without enough history never match
+        matches = np.ones(len(tickers), dtype=bool)
+        for left, compare, right in parsed:
+            with np.errstate(invalid="ignore"):
+                matches &= compare(value(left), value(right))
+        # stocks that stopped trading before the screened date only have carried forward prices
+        current = np.array([ticker in last_dates and pd.Timestamp(last_dates[ticker][1]).date() >= dates[-1] for ticker in tickers], dtype=bool)
+        hits = np.flatnonzero(matches & current)
+        result = pd.DataFrame({"TickerSymbol": [tickers[i] for i in hits]})
+        for column in ["ClosePrice"] + _column_names(names):
+            result[column] = columns[column][-1, hits]
+        result.insert(1, "Date", dates[-1])
+        return result
+
+
+def _column_names(indicator_names):
+    """Column names compute_indicators produces for the given indicators"""
+    columns = []
+    for name in indicator_names:
+        kind, window = indicators.parse_indicator(name)
+        label = f"{kind}{window}"
+        columns.extend([f"{label}_Upper", f"{label}_Middle", f"{label}_Lower"] if kind == "BB" else [label])
+    return columns
+
+
+def _parse_condition(condition):
+    """Splits "RSI14 < 30" into (("RSI14", "RSI14"), operator.lt, 30.0)"""
+    match = CONDITION_PATTERN.match(condition)
+    if match is None:
+        raise ValueError(f"Invalid condition: {condition}")
+    left, symbol, right = match.groups()
+    return _parse_side(left), OPERATORS[symbol], _parse_side(right)
+
+
+def _parse_side(side):
+    """
+    A number, or the indicator to compute and the column read from it
+    eg. "30" -> 30.0, "Close" -> (None, "ClosePrice"), "SMA200" -> ("SMA200", "SMA200"), "BB20_Lower" -> ("BB20", "BB20_Lower")
+    """
+    try:
+        return float(side)
+    except ValueError:
+        pass
+    if side.upper() in CLOSE_NAMES:
+        return None, "ClosePrice"
+    name, _, band = side.upper().partition("_")
+    kind, window = indicators.parse_indicator(name)
+    if kind == "BB" and band:
+        if band not in ("UPPER", "MIDDLE", "LOWER"):
+            raise ValueError(f"Unknown Bollinger band: {side}")
+        return f"BB{window}", f"BB{window}_{band.title()}"
+    if kind == "BB":
+        return f"BB{window}", f"BB{window}_Middle"
+    return f"{kind}{window}", f"{kind}{window}"
+
+
+def _covariance(returns, correlation):
+    """
+    Covariance or correlation of the columns of a returns matrix
+    returns: one row per day and one column per ticker
+    Columns with a missing return are NaN in the result
+    """
+    count = returns.shape[1]
+    out = np.full((count, count), np.nan)
+    valid = np.flatnonzero(np.isfinite(returns).all(axis=0)) if len(returns) > 1 else np.array([], dtype=int)
+    if len(valid) == 0:
+        return out
+    centred = returns[:, valid] - returns[:, valid].mean(axis=0)
+    # a single matrix product covers every pair of tickers
+    matrix = centred.T @ centred / (len(returns) - 1)
+    if correlation:
+        deviation = np.sqrt(np.diag(matrix))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matrix = matrix / np.outer(deviation, deviation)
+        np.fill_diagonal(matrix, np.where(deviation > 0, 1.0, np.nan))
+    out[np.ix_(valid, valid)] = matrix
+    return out
+
+
+if __name__ == "__main__":
+    universe = CrossSection()
+    print(universe.screen(["RSI14 < 30", "Close > SMA200"]))
+    print(universe.correlation_matrix(window=60))
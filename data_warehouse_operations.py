@@ -1,190 +1,445 @@
-import pyodbc
+import asyncio
+import aiohttp
 import yfinance as yf
 import pandas as pd
-import os
 import datetime
-import configparser
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import trading_calendar
+from alpha_vantage_client import AlphaVantageError, fetch_daily
+from connection_pool import load_config
+from instrumentation import UPDATE_FETCH_SECONDS, UPDATE_TICKER_SECONDS, UPDATE_TICKERS, query_timer
+from price_mirror import get_mirror
+from rollups import DEFAULT_MAX_POINTS, get_rollups
+from storage_backends import PRICE_COLUMNS, QUERY_CHUNK, get_backend
+from ticker_registry import get_registry
+
+
+def price_rows(ticker, df):
+    """
+    Converts a frame of daily prices to the row tuples written to StockInformation
+    Whole columns are converted at once to plain python values the database drivers understand
+    ticker: ticker name eg "AAPL"
+    df: DataFrame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns
+    """
+    columns = [
+        [ticker] * len(df),
+        pd.to_datetime(df['Date']).dt.date.tolist(),
+        df['OpenPrice'].astype(float).tolist(),
+        df['ClosePrice'].astype(float).tolist(),
+        df['HighPrice'].astype(float).tolist(),
+        df['LowPrice'].astype(float).tolist(),
+        df['Volume'].astype('int64').tolist(),
+    ]
+    return list(zip(*columns))
+
 
 class DW_Stock:
-    def __init__(self):
-        """
-        Initializes configuration parameters and sets up several standard SQL queries used in the class
-        """
-        config = configparser.ConfigParser()
-        config.read("configs\config.ini")
-        # setting up the connection to the data warehouse
-        # if there is a time where the sql connection lags with no error there maybe an issue with the drivers being updated
-        # without your knowledge
-        self.conn = pyodbc.connect(driver='{SQL Server Native Client 11.0}',
-                              server=config["Data Warehouse"]["server"],
-                              database=config["Data Warehouse"]["database"],
-                              uid=config["Data Warehouse"]["username"],
-                              pwd=config["Data Warehouse"]["password"])
-        # initialzing a cursor for general database use
-        self.cursor = self.conn.cursor()
-        # adding the Alpha Vantage API Key
-        self.alpha_vantage_key = config["Alpha Vantage"]["api_key"]
-        
-        # standard SQL queries
-        self.stock_day_check = """ 
-            SELECT *
-            FROM [StockDataWarehouse].dbo.StockInformation s
-            WHERE s.TickerSymbol= ? AND s.Date = ?
+    def __init__(self, backend=None):
         """
-        self.insert_stock = """
-            INSERT INTO [StockDataWarehouse].dbo.StockInformation (TickerSymbol, Date, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        self.update_stock = """
-            UPDATE [StockDataWarehouse].dbo.StockInformation
-            SET OpenPrice = ?, ClosePrice = ?, HighPrice = ?, LowPrice = ?, Volume = ?
-            WHERE TickerSymbol = ? AND Date = ?
+        Initializes configuration parameters used in the class
+        backend: storage backend holding the warehouse, defaults to the one in the configuration file
         """
+        config = load_config()
+        self.backend = backend if backend is not None else get_backend()
+        # connections to the data warehouse are borrowed from the backend's pool for each operation
+        self.pool = self.backend.pool
+        # the stocks held in the warehouse, shared with everything else in the process using the same backend
+        self.registry = get_registry(self.backend)
+        # local copy of the prices refreshed through the registry after every write, None when it is not configured
+        self.mirror = get_mirror(self.backend)
+        # weekly and monthly bars rebuilt through the registry after every write
+        self.rollups = get_rollups(self.backend)
+        # adding the Alpha Vantage API Key
+        self.alpha_vantage_key = config["Alpha Vantage"]["api_key"]
+        # number of rows sent to the warehouse per batch when bulk loading
+        self.bulk_batch_size = config["Data Warehouse"].getint("bulk_batch_size", 5000)
+        # settings for the daily update across every stock in the warehouse
+        self.update_workers = config["Data Warehouse"].getint("update_workers", 4)
+        self.update_chunk_size = config["Data Warehouse"].getint("update_chunk_size", 50)
+        self.update_retries = config["Data Warehouse"].getint("update_retries", 3)
+        self.update_backoff = config["Data Warehouse"].getfloat("update_backoff", 1.0)
+        # how many calendar days back dw_sync looks for holes in the history
+        self.sync_repair_days = config["Data Warehouse"].getint("sync_repair_days", 30)
 
 
     def dw_setup(self, ticker):
         """
         Set up new stocks into the database table
+        Blocks until the download is done, the web application queues new tickers on alpha_vantage_client.OnboardingQueue instead
+        Returns False when Alpha Vantage has no history for the ticker
         """
-        # Alpha Vantage API key
-        API_KEY = self.alpha_vantage_key
         # Ticker Abbreviation
-        symbol = f'{ticker}'  
-
-        # Get data from Alpha Vantage API
-        url = f'https://www.alphavantage.co/query'
-        params = {
-            'function': 'TIME_SERIES_DAILY',
-            'symbol': symbol,
-            'apikey': API_KEY,
-            'outputsize': 'full'
-        }
-
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data == []:
+        symbol = f'{ticker}'
+
+        # a ticker already in the warehouse only needs the days it is missing, not the whole history again
+        if self.dw_high_water_marks([symbol]):
+            _, failed = self.dw_sync([symbol])
+            return symbol not in failed
+
+        # Get data from Alpha Vantage API, throttling and network errors are retried by the client
+        try:
+            df = fetch_daily(symbol)
+        except (AlphaVantageError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"{symbol}: download failed ({e})")
             return False
 
-        # Convert data into a DataFrame
-        time_series = data['Time Series (Daily)']
-        df = pd.DataFrame.from_dict(time_series, orient='index')
-        df['Date'] = pd.to_datetime(df.index)
-        df['OpenPrice'] = pd.to_numeric(df['1. open'])
-        df['ClosePrice'] = pd.to_numeric(df['4. close'])
-        df['HighPrice'] = pd.to_numeric(df['2. high'])
-        df['LowPrice'] = pd.to_numeric(df['3. low'])
-        df['Volume'] = pd.to_numeric(df['5. volume'])
+        self.dw_load_history(symbol, df)
+        return True
 
-        df = df[['Date', 'OpenPrice', 'ClosePrice', 'HighPrice', 'LowPrice', 'Volume']]
+    def dw_load_history(self, ticker, df):
+        """
+        Writes the downloaded history of a new ticker and registers it
+        ticker: ticker name eg "AAPL"
+        df: DataFrame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns
+        """
+        # Insert the data into the warehouse in batches
+        rows = self.dw_bulk_load(ticker, df)
 
-        # Insert the data into SQL Server
-        for index, row in df.iterrows():
-            self.cursor.execute(self.insert_stock, symbol, row['Date'], row['OpenPrice'], row['ClosePrice'], row['HighPrice'], row['LowPrice'], row['Volume'])
+        # registering the new ticker so the existence checks and the update jobs pick it up
+        self.registry.refresh([ticker])
+        return rows
 
-        self.conn.commit()
 
-        # check if the stock is previous available the stock list
-        with open(f"{curr_dir}\supportive\stock_list.txt",'r') as file:
-            stock_list = file.readlines()
-        for ticker in stock_list:
-            if ticker.strip() == ticker:
-                return True
+    def dw_bulk_load(self, ticker, df, batch_size=None):
+        """
+        Loads a frame of daily prices for one ticker into the warehouse in batches with one commit per batch
+        Days already in the warehouse are overwritten so loading the same frame twice leaves no duplicates
+        ticker: ticker name eg "AAPL"
+        df: DataFrame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns
+        batch_size: rows sent per batch, defaults to bulk_batch_size in the configuration file
+        Returns the number of rows loaded
+        """
+        if batch_size is None:
+            batch_size = self.bulk_batch_size
+        started = time.perf_counter()
+        rows = price_rows(ticker, df)
 
-        # add ticker to list of stocks in warehouse
-        curr_dir = os.getcwd()
-        with open(f"{curr_dir}\supportive\stock_list.txt",'a') as file:
-            file.write(f"{ticker}\n")
+        with query_timer("DW_Stock", "dw_bulk_load") as timer, self.pool.connection() as conn:
+            for batch_start in range(0, len(rows), batch_size):
+                self.backend.upsert_rows(conn, "StockInformation", ["TickerSymbol", "Date"], PRICE_COLUMNS, rows[batch_start:batch_start + batch_size])
+                conn.commit()
+            timer.rows = len(rows)
+
+        elapsed = time.perf_counter() - started
+        print(f"{ticker}: loaded {len(df)} rows in {elapsed:.2f}s ({len(df) / max(elapsed, 1e-9):.0f} rows/sec)")
+        return len(df)
 
-        return True
 
+    def dw_upsert(self, rows):
+        """
+        Writes a batch of daily prices, updating the days already in the warehouse and inserting the rest in one set based statement
+        rows: list of (TickerSymbol, Date, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume) tuples
+        """
+        if not rows:
+            return 0
+        with query_timer("DW_Stock", "dw_upsert") as timer, self.pool.connection() as conn:
+            self.backend.upsert_rows(conn, "StockInformation", ["TickerSymbol", "Date"], PRICE_COLUMNS, rows)
+            conn.commit()
+            timer.rows = len(rows)
+        return len(rows)
 
-    def dw_update(self):
-        """
-        Procedure to update stocks within the database
-        """
-        # Getting list of stocks in database
-        curr_dir = os.getcwd()
-        with open(f"{curr_dir}\supportive\stock_list.txt",'r') as file:
-            stock_list = file.readlines()
-
-        for ticker in stock_list:
-            # Running the update for each stock in stock list
-            # standardizing the ticker input and removing excess whitespace
-            ticker = ticker.strip()
-
-            # exception incase the day is sunday or monday
-            if datetime.datetime.today().weekday() == 0 or datetime.datetime.today().weekday() == 7:
-                print("There is no stocks today, cancelling today's update")
-                return
-            
-            # download stock information of given ticker for the past day
-            stock_data = yf.download(ticker, start =datetime.date.today() - datetime.timedelta(days=1), end=datetime.date.today(), auto_adjust=True)
-            stock_data['Date'] = pd.to_datetime(stock_data.index[0])
-            stock_data['TickerSymbol'] = ticker
-
-            # Converting the types as need for SQL server types
-            stock_data['Open'] = stock_data['Open'].astype(float)
-            stock_data['Close'] = stock_data['Close'].astype(float)
-            stock_data['High'] = stock_data['High'].astype(float)
-            stock_data['Low'] = stock_data['Low'].astype(float)
-            stock_data['Volume'] = stock_data['Volume'].astype(int)
-
-            #print(stock_data)
-            # Seperating the wanted columns
-            stock_data = stock_data[['TickerSymbol', 'Date', 'Open', 'Close', 'High', 'Low', 'Volume']]
-        
-            #extracting the wanted values for the entry check and the day's data
-            check_ticker = stock_data.iloc[0,0]
-            check_date = stock_data.iloc[0,1]
-            day_open = stock_data.iloc[0,2]
-            day_close = stock_data.iloc[0,3]
-            day_high = stock_data.iloc[0,4]
-            day_low = stock_data.iloc[0,5]
-            day_volume = stock_data.iloc[0,6]
-            
-            # check if stock already updated for the day
-            self.cursor.execute(self.stock_day_check,check_ticker, check_date)
-            data_exists = self.cursor.fetchall()
-
-            if len(data_exists) > 0:
-                # if record already exists update the record
-                self.cursor.execute(self.update_stock, float(day_open), float(day_close), float(day_high), float(day_low), int(day_volume), check_ticker, check_date)
-                print(check_ticker, "\nStock Updated")
-                self.conn.commit()
+    def _download(self, tickers, start, end):
+        """
+        Downloads daily prices for several tickers in one yfinance request
+        tickers: list of ticker names
+        start: first date downloaded
+        end: day after the last date downloaded
+        Returns a dict of ticker to DataFrame, tickers without data are left out
+        """
+        data = yf.download(tickers, start=start, end=end, auto_adjust=True, group_by='ticker',
+                           progress=False, threads=False)
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for ticker in tickers:
+            # batched downloads come back with a (ticker, field) column index
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                frame = data[ticker]
             else:
-                # record is new, insert the record
-                self.cursor.execute(self.insert_stock, check_ticker, check_date, float(day_open), float(day_close), float(day_high), float(day_low), int(day_volume))
-                print("Day inserted")
-                self.conn.commit()
+                frame = data
+            frame = frame.dropna(how='all')
+            if frame.empty:
+                continue
+            frames[ticker] = pd.DataFrame({
+                'Date': pd.to_datetime(frame.index),
+                'OpenPrice': frame['Open'].astype(float),
+                'ClosePrice': frame['Close'].astype(float),
+                'HighPrice': frame['High'].astype(float),
+                'LowPrice': frame['Low'].astype(float),
+                'Volume': frame['Volume'].fillna(0).astype('int64'),
+            })
+        return frames
+
+    def _timed_fetch_chunk(self, tickers, start, end, retries):
+        """_fetch_chunk with its duration recorded in the update metrics and returned after its results"""
+        started = time.perf_counter()
+        frames, errors = self._fetch_chunk(tickers, start, end, retries)
+        elapsed = time.perf_counter() - started
+        UPDATE_FETCH_SECONDS.observe(elapsed)
+        return frames, errors, elapsed
+
+    def _fetch_chunk(self, tickers, start, end, retries):
+        """
+        Downloads a chunk of tickers, retrying the ones that failed or came back empty on their own with a growing delay
+        Returns a dict of ticker to DataFrame and a dict of ticker to the last error for tickers that never succeeded
+        """
+        frames, errors = {}, {}
+        try:
+            frames = self._download(tickers, start, end)
+        except Exception as e:
+            errors = {ticker: e for ticker in tickers}
+        missing = [ticker for ticker in tickers if ticker not in frames]
+
+        for ticker in missing:
+            # reported as failed even when retries is 0, unless the download already raised
+            errors.setdefault(ticker, ValueError("no data returned"))
+            for attempt in range(retries):
+                time.sleep(self.update_backoff * 2 ** attempt)
+                try:
+                    result = self._download([ticker], start, end)
+                except Exception as e:
+                    errors[ticker] = e
+                    continue
+                if ticker in result:
+                    frames[ticker] = result[ticker]
+                    errors.pop(ticker, None)
+                    break
+                errors[ticker] = ValueError("no data returned")
+        return frames, errors
+
+    def _stock_list(self):
+        """Getting list of stocks in database"""
+        return self.registry.tickers()
+
+    def _run_update(self, jobs, max_workers, retries):
+        """
+        Downloads the jobs on a pool of worker threads while this thread writes the results in batches
+        jobs: list of (tickers, start, end) where end is the day after the last date downloaded
+        Returns the number of rows written and a dict of ticker to error for the tickers that could not be updated
+        """
+        written, failed, pending, updated = 0, {}, [], []
+        # download time of the chunk each ticker in pending came from, its latency is recorded once the batch is written
+        waiting = []
+
+        def flush():
+            started = time.perf_counter()
+            count = self.dw_upsert(pending)
+            write_seconds = time.perf_counter() - started
+            for fetch_seconds in waiting:
+                UPDATE_TICKER_SECONDS.observe(fetch_seconds + write_seconds)
+            waiting.clear()
+            return count
+
+        # sessions that came back empty although the ticker traded after them, remembered so dw_sync stops asking
+        empty = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._timed_fetch_chunk, tickers, start, end, retries): (start, end) for tickers, start, end in jobs}
+            for future in as_completed(futures):
+                frames, errors, fetch_seconds = future.result()
+                failed.update(errors)
+                sessions = trading_calendar.trading_days(futures[future][0], futures[future][1] - datetime.timedelta(days=1))
+                for ticker, frame in frames.items():
+                    pending.extend(price_rows(ticker, frame))
+                    updated.append(ticker)
+                    waiting.append(fetch_seconds)
+                    days = set(pd.to_datetime(frame['Date']).dt.date)
+                    empty.extend((ticker, day) for day in sessions if day < max(days) and day not in days)
+                # a single writer keeps the batches large and the warehouse free of competing transactions
+                if len(pending) >= self.bulk_batch_size:
+                    written += flush()
+                    pending = []
+        written += flush()
+        if empty:
+            checked = datetime.datetime.now().replace(microsecond=0)
+            with self.pool.connection() as conn:
+                self.backend.upsert_rows(conn, "StockEmptySessions", ["TickerSymbol", "Date"], ["TickerSymbol", "Date", "CheckedAt"],
+                                         [(ticker, day, checked) for ticker, day in empty])
+                conn.commit()
+        # moving the registry's dates on for every ticker that received rows
+        self.registry.refresh(updated)
+        UPDATE_TICKERS.inc(len(set(updated)), result="updated")
+        UPDATE_TICKERS.inc(len(failed), result="failed")
+
+        for ticker, error in failed.items():
+            print(f"{ticker}: update failed ({error})")
+        return written, failed
+
+    def dw_update(self, max_workers=None, chunk_size=None, retries=None):
+        """
+        Procedure to update stocks within the database with the previous trading session
+        Tickers are downloaded in chunks by a pool of worker threads while this thread writes the results in batches
+        Use dw_sync to catch up after missed runs
+        max_workers: number of download threads, defaults to update_workers in the configuration file
+        chunk_size: tickers per yfinance request, defaults to update_chunk_size in the configuration file
+        retries: attempts per ticker after a failed download, defaults to update_retries in the configuration file
+        Returns the number of rows written and a dict of ticker to error for the tickers that could not be updated
+        """
+        max_workers = max_workers or self.update_workers
+        chunk_size = chunk_size or self.update_chunk_size
+        retries = self.update_retries if retries is None else retries
+        stock_list = self._stock_list()
+
+        # the session before today, so a monday run picks up friday and a run after a holiday skips the holiday
+        session = trading_calendar.previous_trading_day(datetime.date.today())
+        start = session
+        end = session + datetime.timedelta(days=1)
+        jobs = [(stock_list[i:i + chunk_size], start, end) for i in range(0, len(stock_list), chunk_size)]
+
+        written, failed = self._run_update(jobs, max_workers, retries)
+        print(f"Updated {len(stock_list) - len(failed)} of {len(stock_list)} stocks for {session}, {written} rows written")
+        return written, failed
+
+    def dw_high_water_marks(self, tickers=None):
+        """
+        Latest date held for every ticker, read from the ticker registry
+        tickers: optional list of tickers to limit the result to
+        Returns a dict of ticker to datetime.date
+        """
+        entries = self.registry.entries(tickers)
+        return {ticker: last_date for ticker, (_, last_date, _, _) in entries.items() if last_date is not None}
+
+    def dw_missing_ranges(self, tickers=None, end=None, repair_days=None, marks=None, first_dates=None):
+        """
+        Trading day ranges that are not in the warehouse yet for each ticker
+        Covers everything after the ticker's latest date plus holes inside the last repair_days calendar days
+        Nothing before a ticker's first date counts as missing, nor sessions a download already came back empty for
+        tickers: tickers to check, defaults to every ticker in the warehouse
+        end: last session that should be held, defaults to the last session with final prices
+        repair_days: how far back to look for holes, defaults to sync_repair_days in the configuration file
+        marks: latest date per ticker if dw_high_water_marks was already called
+        first_dates: first date per ticker if the registry entries were already read
+        Returns a dict of ticker to a list of (first date, last date) ranges, tickers that were never set up are left out
+        """
+        if end is None:
+            end = trading_calendar.last_completed_session()
+        if repair_days is None:
+            repair_days = self.sync_repair_days
+        if marks is None or first_dates is None:
+            entries = self.registry.entries(tickers if marks is None else list(marks))
+            if marks is None:
+                marks = {ticker: last_date for ticker, (_, last_date, _, _) in entries.items() if last_date is not None}
+            if first_dates is None:
+                first_dates = {ticker: first_date for ticker, (first_date, _, _, _) in entries.items()}
+        window_start = end - datetime.timedelta(days=repair_days)
+
+        # dates already held or known to be empty inside the repair window, the ticker predicate lets both reads seek on (TickerSymbol, Date)
+        checked = list(marks)
+        data = []
+        with query_timer("DW_Stock", "dw_missing_ranges") as timer, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(checked), QUERY_CHUNK):
+                chunk = checked[i:i + QUERY_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(self.backend.sql(f"""
+                    SELECT s.TickerSymbol, s.Date
+                    FROM {{StockInformation}} s
+                    WHERE s.TickerSymbol IN ({placeholders}) AND s.Date BETWEEN ? AND ?
+                    UNION ALL
+                    SELECT e.TickerSymbol, e.Date
+                    FROM {{StockEmptySessions}} e
+                    WHERE e.TickerSymbol IN ({placeholders}) AND e.Date BETWEEN ? AND ?
+                """), chunk + [window_start, end] + chunk + [window_start, end])
+                data.extend(cursor.fetchall())
+            timer.rows = len(data)
+        held = {}
+        for ticker, day in data:
+            held.setdefault(ticker, set()).add(pd.Timestamp(day).date())
+
+        sessions = trading_calendar.trading_days(min([window_start] + [trading_calendar.next_trading_day(mark) for mark in marks.values()]), end)
+        ranges = {}
+        for ticker, mark in marks.items():
+            first = min(window_start, trading_calendar.next_trading_day(mark))
+            # a ticker with less history than the repair window is not missing the sessions before it was listed
+            if first_dates.get(ticker) is not None:
+                first = max(first, first_dates[ticker])
+            have = held.get(ticker, set())
+            missing = [day for day in sessions if day >= first and day not in have]
+            # collapsing consecutive missing sessions into ranges
+            runs = []
+            for day in missing:
+                if runs and trading_calendar.next_trading_day(runs[-1][1]) == day:
+                    runs[-1][1] = day
+                else:
+                    runs.append([day, day])
+            if runs:
+                ranges[ticker] = [tuple(run) for run in runs]
+        return ranges
+
+    def dw_sync(self, tickers=None, end=None, repair_days=None, max_workers=None, chunk_size=None, retries=None):
+        """
+        Incremental sync that only downloads the trading days missing from the warehouse and upserts them
+        Safe to run at any time, nothing already held is downloaded again
+        tickers: tickers to sync, defaults to the stock list
+        end: last session that should be held, defaults to the last session with final prices
+        repair_days: how far back to look for holes, defaults to sync_repair_days in the configuration file
+        max_workers, chunk_size, retries: same as dw_update
+        Returns the number of rows written and a dict of ticker to error for the tickers that could not be synced
+        """
+        max_workers = max_workers or self.update_workers
+        chunk_size = chunk_size or self.update_chunk_size
+        retries = self.update_retries if retries is None else retries
+        if tickers is None:
+            tickers = self._stock_list()
+
+        entries = self.registry.entries(tickers)
+        marks = {ticker: last_date for ticker, (_, last_date, _, _) in entries.items() if last_date is not None}
+        for ticker in tickers:
+            if ticker not in marks:
+                print(f"{ticker}: not in the warehouse yet, run dw_setup first")
+        first_dates = {ticker: first_date for ticker, (first_date, _, _, _) in entries.items()}
+        ranges = self.dw_missing_ranges(tickers, end, repair_days, marks=marks, first_dates=first_dates)
+
+        # tickers missing the same range share one batched download
+        by_range = {}
+        for ticker, runs in ranges.items():
+            for first, last in runs:
+                by_range.setdefault((first, last), []).append(ticker)
+        jobs = []
+        for (first, last), group in by_range.items():
+            for i in range(0, len(group), chunk_size):
+                jobs.append((group[i:i + chunk_size], first, last + datetime.timedelta(days=1)))
+
+        written, failed = self._run_update(jobs, max_workers, retries)
+        print(f"Synced {len(ranges) - len(failed)} of {len(ranges)} stocks with gaps, {written} rows written")
+        return written, failed
     
 
     def dw_std_query(self, ticker):
         """ Querying 1 year worth of data from the database """
-        sql_statement = """
+        sql_statement = self.backend.sql("""
             SELECT *
-            FROM [StockDataWarehouse].dbo.StockInformation s
+            FROM {StockInformation} s
             WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
             ORDER BY s.Date DESC
-        """
+        """)
         date_start = datetime.date.today() - datetime.timedelta(days=365)
         date_end = datetime.date.today()
-        self.cursor.execute(sql_statement, date_start.strftime("%Y-%m-%d"), date_end.strftime("%Y-%m-%d"), ticker)
-        data = self.cursor.fetchall()
+        with query_timer("DW_Stock", "dw_std_query") as timer, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_statement, (date_start.strftime("%Y-%m-%d"), date_end.strftime("%Y-%m-%d"), ticker))
+            data = cursor.fetchall()
+            timer.rows = len(data)
         return data
 
-    def dw_check_stock(self, ticker):
-        """Query to check whether stock has been updated or not"""
-        self.stock_check = """ 
-            SELECT *
-            FROM [StockDataWarehouse].dbo.StockInformation s
-            WHERE s.TickerSymbol= ?
+    def dw_history_query(self, ticker, start_date=None, end_date=None, max_points=DEFAULT_MAX_POINTS, resolution=None):
         """
-        self.cursor.execute(self.stock_check, ticker)
-        data = self.cursor.fetchall()
-        if len(data) == 0:
-            return False
-        return True
+        Price history over any range at the finest resolution that fits in max_points
+        Long ranges are read from the weekly or monthly bars instead of every day, see Rollups.query
+        start_date, end_date: dates covered, defaults to the last year like dw_std_query
+        resolution: "daily", "weekly" or "monthly", defaults to the one chosen from max_points
+        Returns (resolution, downsampled, DataFrame)
+        """
+        end_date = end_date or datetime.date.today()
+        start_date = start_date or end_date - datetime.timedelta(days=365)
+        return self.rollups.query(ticker, start_date, end_date, max_points, resolution)
+
+    def dw_check_stock(self, ticker):
+        """Check whether the stock is in the data warehouse, answered from the in memory registry"""
+        return self.registry.contains(ticker)
          
 if __name__ == "__main__":
     test = DW_Stock()
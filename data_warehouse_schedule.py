@@ -1,13 +1,48 @@
+# The purpose of this file is to run the data warehouse jobs after every trading session
+# The sync catches every stock up to the session that just closed, then the precomputed indicators are brought up to date.
+# Set metrics_port in the Scheduler section of the configuration file to expose the job metrics for Prometheus.
+
+import logging
+import time
+
 from apscheduler.schedulers.blocking import BlockingScheduler
-from datetime import datetime
-from data_warehouse_update import dw_update
+
+import indicator_job
+import instrumentation
+from connection_pool import load_config
+from data_warehouse_operations import DW_Stock
+from instrumentation import ERRORS, JOB_SECONDS
+from trading_calendar import MARKET_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+
+def daily_update():
+    """Syncs every stock up to the last completed session and refreshes the indicators computed from them"""
+    started = time.perf_counter()
+    try:
+        # dw_sync also fills sessions a missed run left behind, which dw_update on its own would skip
+        with JOB_SECONDS.time(job="dw_sync"):
+            written, failed = DW_Stock().dw_sync()
+        with JOB_SECONDS.time(job="indicators"):
+            indicator_job.run()
+    except Exception:
+        logger.exception("Daily update failed")
+        ERRORS.inc(component="daily_update")
+        return
+    logger.info("Daily update wrote %s rows in %.1fs, %s stocks failed", written, time.perf_counter() - started, len(failed))
+
 
 def start_updates():
-    scheduler = BlockingScheduler()
-    scheduler.add_job(dw_update, 'cron', day= "mon-fri", hour='16')
+    """Runs daily_update every weekday at 16:30 New York time, after the closing prices are published"""
+    port = load_config().getint("Scheduler", "metrics_port", fallback=0)
+    if port:
+        instrumentation.serve(port)
+    scheduler = BlockingScheduler(timezone=MARKET_TIMEZONE)
+    scheduler.add_job(daily_update, 'cron', day_of_week="mon-fri", hour=16, minute=30)
     scheduler.start()
 
+
 if __name__ == "__main__":
-    scheduler = BlockingScheduler()
-    scheduler.add_job(dw_update, 'cron', day= "mon-fri", hour='16')
-    scheduler.start()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    start_updates()
@@ -0,0 +1,171 @@
+# The purpose of this file is to precompute the standard indicators for every stock into the StockIndicators table
+# Tickers are spread over a pool of worker processes that each read one ticker's history and run the vectorized
+# indicator engine on it, the results are written back in batches by this process.
+# Run it after the daily update eg. python indicator_job.py
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import indicators
+from connection_pool import load_config
+from storage_backends import INDICATOR_COLUMNS, QUERY_CHUNK, get_backend
+from ticker_registry import get_registry
+
+# indicators kept in StockIndicators, compute_indicators turns these into INDICATOR_COLUMNS
+MATERIALIZED_INDICATORS = ["SMA50", "SMA200", "EMA50", "EMA200", "RSI14", "BB20"]
+
+_worker_backend = None
+
+
+def _init_worker(backend):
+    """Runs once in each worker process, the backend opens its own connections there"""
+    global _worker_backend
+    _worker_backend = backend
+
+
+def compute_ticker(ticker, since=None, backend=None):
+    """
+    Computes the materialized indicators over a ticker's whole history
+    ticker: ticker name eg "AAPL"
+    since: only dates from this one on are returned, None returns every date
+    backend: storage backend to read from, defaults to the worker's backend
+    Returns the ticker, the dates and a 2D array with one column per entry in INDICATOR_COLUMNS
+    """
+    backend = backend or _worker_backend
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.sql("""
+            SELECT Date, ClosePrice
+            FROM {StockInformation} s
+            WHERE s.TickerSymbol = ?
+            ORDER BY Date ASC
+        """), (ticker,))
+        results = cursor.fetchall()
+    dates, closes = indicators.as_arrays(results)
+    columns = indicators.compute_indicators(closes, MATERIALIZED_INDICATORS)
+    values = np.column_stack([columns[column] for column in INDICATOR_COLUMNS]) if len(closes) else np.empty((0, len(INDICATOR_COLUMNS)))
+
+    # the EMA and RSI need the full history to be right, but only the dates from the first missing one have to be written
+    if since is not None and len(dates):
+        keep = pd.to_datetime(dates) >= pd.Timestamp(since)
+        dates, values = dates[keep], values[keep]
+    return ticker, dates, values
+
+
+def indicator_high_water_marks(backend, tickers=None):
+    """
+    Latest date with indicators for every ticker
+    Returns a dict of ticker to datetime.date
+    """
+    return {ticker: last_date for ticker, (last_date, _) in _indicator_coverage(backend, tickers).items()}
+
+
+def _indicator_coverage(backend, tickers=None):
+    """Latest date and number of dates with indicators for every ticker, as a dict of ticker to (datetime.date, int)"""
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(backend.sql("""
+            SELECT TickerSymbol, MAX(Date), COUNT(*)
+            FROM {StockIndicators}
+            GROUP BY TickerSymbol
+        """))
+        data = cursor.fetchall()
+    coverage = {ticker: (pd.Timestamp(last_date).date(), count) for ticker, last_date, count in data}
+    if tickers is not None:
+        coverage = {ticker: coverage[ticker] for ticker in tickers if ticker in coverage}
+    return coverage
+
+
+def first_missing_dates(backend, tickers):
+    """
+    Earliest price date without indicators for each ticker, tickers with indicators for every price date are left out
+    tickers: tickers to check
+    Returns a dict of ticker to datetime.date
+    """
+    tickers = list(dict.fromkeys(tickers))
+    data = []
+    with backend.pool.connection() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(tickers), QUERY_CHUNK):
+            chunk = tickers[i:i + QUERY_CHUNK]
+            cursor.execute(backend.sql(f"""
+                SELECT s.TickerSymbol, MIN(s.Date)
+                FROM {{StockInformation}} s
+                LEFT JOIN {{StockIndicators}} i ON i.TickerSymbol = s.TickerSymbol AND i.Date = s.Date
+                WHERE s.TickerSymbol IN ({', '.join('?' * len(chunk))}) AND i.Date IS NULL
+                GROUP BY s.TickerSymbol
+            """), chunk)
+            data.extend(cursor.fetchall())
+    return {ticker: pd.Timestamp(first_date).date() for ticker, first_date in data}
+
+
+def _indicator_rows(ticker, dates, values):
+    """Row tuples for StockIndicators, NaN warm up values are stored as NULL"""
+    cells = values.astype(object)
+    cells[np.isnan(values)] = None
+    days = pd.to_datetime(dates).date
+    return [(ticker, day) + tuple(row) for day, row in zip(days, cells.tolist())]
+
+
+def run(tickers=None, full=False, workers=None, batch_size=None, backend=None):
+    """
+    Brings StockIndicators up to date
+    tickers: tickers to process, defaults to every ticker in the registry
+    full: recompute and rewrite every date instead of only the dates from each ticker's first price without indicators
+    workers: number of worker processes, defaults to indicator_workers in the configuration file or the CPU count
+    batch_size: rows written per batch, defaults to bulk_batch_size in the configuration file
+    backend: storage backend holding the warehouse, defaults to the one in the configuration file
+    Returns the number of rows written
+    """
+    backend = backend or get_backend()
+    section = load_config()["Data Warehouse"]
+    workers = workers or section.getint("indicator_workers", 0) or None
+    batch_size = batch_size or section.getint("bulk_batch_size", 5000)
+    started = time.perf_counter()
+
+    registry = get_registry(backend)
+    entries = registry.entries(tickers)
+    if full:
+        jobs = [(ticker, None) for ticker, (_, last_date, _, _) in entries.items() if last_date is not None]
+    else:
+        coverage = _indicator_coverage(backend, list(entries))
+        # fewer indicator rows than price rows means new days or a hole filled since the last run, the rest are skipped
+        behind = [ticker for ticker, (_, last_date, day_count, _) in entries.items()
+                  if last_date is not None and (ticker not in coverage or coverage[ticker][1] < day_count)]
+        # a filled hole changes the EMA and RSI of every later date too, so each ticker is rewritten from its first gap
+        jobs = list(first_missing_dates(backend, behind).items())
+
+    written, pending = 0, []
+    columns = ["TickerSymbol", "Date"] + INDICATOR_COLUMNS
+
+    def flush(rows):
+        with backend.pool.connection() as conn:
+            backend.upsert_rows(conn, "StockIndicators", ["TickerSymbol", "Date"], columns, rows)
+            conn.commit()
+        return len(rows)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(backend,)) as executor:
+        futures = [executor.submit(compute_ticker, ticker, since) for ticker, since in jobs]
+        for future in as_completed(futures):
+            try:
+                ticker, dates, values = future.result()
+            except Exception as e:
+                print(f"Indicator computation failed: {e}")
+                continue
+            pending.extend(_indicator_rows(ticker, dates, values))
+            if len(pending) >= batch_size:
+                written += flush(pending)
+                pending = []
+    if pending:
+        written += flush(pending)
+
+    elapsed = time.perf_counter() - started
+    print(f"Indicators for {len(jobs)} of {len(entries)} stocks, {written} rows written in {elapsed:.2f}s")
+    return written
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,231 @@
+# The purpose of this file is to hold the array based indicator engine used by StockMetrics and the web application
+# Every function takes a NumPy array (or anything np.asarray understands) of closing prices ordered by date ascending
+# and returns an array of the same length so the results line up with the dates they were computed from.
+# Positions without enough history to fill the window are NaN. 2D inputs are treated as one series per column.
+
+import re
+import numpy as np
+import pandas as pd
+
+
+def as_arrays(data, date_column="Date", price_column="ClosePrice"):
+    """
+    Splits the input into a dates array and a float64 closing price array
+    data: a DataFrame with date/price columns, a sequence of (date, close) rows or a (dates, closes) tuple
+    date_column: name of the date column when data is a DataFrame
+    price_column: name of the price column when data is a DataFrame
+    """
+    if isinstance(data, pd.DataFrame):
+        return data[date_column].to_numpy(), data[price_column].to_numpy(dtype=np.float64)
+    if isinstance(data, tuple) and len(data) == 2:
+        return np.asarray(data[0]), np.asarray(data[1], dtype=np.float64)
+    # rows straight out of a cursor eg. [(date, close), ...]
+    rows = list(data)
+    dates = np.array([row[0] for row in rows])
+    closes = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    return dates, closes
+
+
+def _prepare(values, window):
+    """Converts the input to float64 and validates the window size"""
+    values = np.asarray(values, dtype=np.float64)
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    return values
+
+
+def _window_sums(values, window):
+    """Sums of every full window ending at each position using a cumulative sum, NaN where the window is not full"""
+    out = np.full(values.shape, np.nan)
+    if values.shape[0] < window:
+        return out
+    # padding with a leading zero row so the first window does not need a special case
+    csum = np.cumsum(values, axis=0)
+    csum = np.concatenate([np.zeros((1,) + values.shape[1:]), csum], axis=0)
+    out[window - 1:] = csum[window:] - csum[:-window]
+    return out
+
+
+def sma(values, window):
+    """
+    Simple moving average, computed with a cumulative sum so the cost is O(n) regardless of the window size
+    values: closing prices ordered by date ascending
+    window: number of periods averaged over
+    """
+    values = _prepare(values, window)
+    return _window_sums(values, window) / window
+
+
+def rolling_std(values, window, ddof=1):
+    """
+    Rolling standard deviation over the same windows as sma
+    values: closing prices ordered by date ascending
+    window: number of periods in each window
+    ddof: delta degrees of freedom, 1 matches statistics.stdev
+    """
+    values = _prepare(values, window)
+    if window - ddof <= 0:
+        raise ValueError("window must be larger than ddof")
+    # removing the overall mean first keeps the sum of squares small and avoids cancellation on large prices
+    centred = values - np.nanmean(values, axis=0) if values.size else values
+    sums = _window_sums(centred, window)
+    squares = _window_sums(centred * centred, window)
+    variance = (squares - sums * sums / window) / (window - ddof)
+    # rounding can leave tiny negative values on flat windows
+    return np.sqrt(np.clip(variance, 0.0, None))
+
+
+def ema(values, window, alpha=None):
+    """
+    Exponential moving average seeded with the first value, y[i] = y[i-1] + alpha * (x[i] - y[i-1])
+    values: closing prices ordered by date ascending
+    window: span of the average, used to derive alpha = 2 / (window + 1)
+    alpha: optional smoothing factor overriding the one derived from the window
+    """
+    values = _prepare(values, window)
+    if alpha is None:
+        alpha = 2 / (window + 1)
+    if values.shape[0] == 0:
+        return values.copy()
+    # pandas runs the recursive filter in compiled code instead of a python loop
+    return pd.DataFrame(values.reshape(values.shape[0], -1)).ewm(alpha=alpha, adjust=False).mean().to_numpy().reshape(values.shape)
+
+
+def bollinger_bands(values, window=20, num_std=2):
+    """
+    Bollinger bands around the simple moving average
+    values: closing prices ordered by date ascending
+    window: number of periods in the moving average
+    num_std: how many standard deviations the bands sit from the average
+    Returns upper, middle and lower bands
+    """
+    middle = sma(values, window)
+    deviation = rolling_std(values, window)
+    return middle + num_std * deviation, middle, middle - num_std * deviation
+
+
+def rsi(values, period=14):
+    """
+    Wilder's relative strength index, the first value is available once period price changes have been seen
+    values: closing prices ordered by date ascending
+    period: number of periods the average gain and loss are smoothed over
+    """
+    values = _prepare(values, period)
+    out = np.full(values.shape, np.nan)
+    if values.shape[0] <= period:
+        return out
+    change = np.diff(values, axis=0)
+    gain = np.clip(change, 0.0, None)
+    loss = np.clip(-change, 0.0, None)
+    # Wilder seeds with a plain average of the first period changes then smooths with alpha = 1 / period
+    gain[period - 1] = gain[:period].mean(axis=0)
+    loss[period - 1] = loss[:period].mean(axis=0)
+    avg_gain = ema(gain[period - 1:], period, alpha=1 / period)
+    avg_loss = ema(loss[period - 1:], period, alpha=1 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        strength = 100 - 100 / (1 + avg_gain / avg_loss)
+    # no losses at all in the window means the index is pinned at 100
+    strength = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), strength)
+    out[period:] = strength
+    return out
+
+
+def from_first_value(function, values, *args, **kwargs):
+    """
+    Runs an indicator on every column of a 2D array from that column's first finite value
+    A leading NaN spoils a whole column for the indicators above, so a stock listed after the others in a date x ticker
+    matrix would never get a value. Columns that start on the same row are computed together in one call.
+    function: indicator eg. sma or compute_indicators, called with the rows from the start onwards plus args and kwargs
+    values: one row per date and one column per series, NaN before each series starts
+    Returns what function returns (an array, a tuple of arrays or a dict of arrays) with NaN before each column's start
+    """
+    values = np.asarray(values, dtype=np.float64)
+    matrix = values.reshape(values.shape[0], int(np.prod(values.shape[1:])))
+    finite = np.isfinite(matrix)
+    first = np.where(finite.any(axis=0), finite.argmax(axis=0) if len(matrix) else 0, len(matrix))
+    starts = [start for start in np.unique(first) if start < len(matrix)]
+    if not starts:
+        # nothing to start from, the indicator still validates its arguments and gives the shape of the result
+        return function(values, *args, **kwargs)
+
+    parts = {}
+    kind = None
+    for start in starts:
+        group = np.flatnonzero(first == start)
+        result = function(matrix[start:, group], *args, **kwargs)
+        kind = type(result)
+        items = result.items() if isinstance(result, dict) else enumerate(result if isinstance(result, tuple) else (result,))
+        for key, part in items:
+            if key not in parts:
+                parts[key] = np.full(matrix.shape, np.nan)
+            parts[key][start:, group] = part
+    parts = {key: part.reshape(values.shape) for key, part in parts.items()}
+    if issubclass(kind, dict):
+        return parts
+    if issubclass(kind, tuple):
+        return tuple(parts[i] for i in range(len(parts)))
+    return parts[0]
+
+
+# indicator names understood by compute_indicators eg. "SMA50", "EMA200", "RSI14", "BB20"
+INDICATOR_PATTERN = re.compile(r"^(SMA|EMA|RSI|BB)(\d+)$")
+
+
+def parse_indicator(name):
+    """
+    Splits an indicator name like "SMA50" into its kind and window
+    name: indicator name, case insensitive
+    """
+    match = INDICATOR_PATTERN.match(name.strip().upper())
+    if match is None:
+        raise ValueError(f"Unknown indicator: {name}")
+    return match.group(1), int(match.group(2))
+
+
+def lookback_days(names):
+    """
+    Number of calendar days of history needed before the first displayed date so every indicator is fully warmed up
+    names: indicator names eg. ["SMA50", "EMA200"]
+    """
+    trading_days = 0
+    for name in names:
+        kind, window = parse_indicator(name)
+        # the EMA never fully forgets its seed, three spans bring the seed's weight well under 1%
+        if kind == "EMA":
+            needed = window * 3
+        # Wilder's averages decay by (1 - 1/window) a day, ten periods leave the seed's weight near e^-10
+        elif kind == "RSI":
+            needed = window * 10
+        else:
+            needed = window + 1
+        trading_days = max(trading_days, needed)
+    if trading_days == 0:
+        return 0
+    # roughly 252 trading days in 365 calendar days, plus a week of slack for holidays
+    return int(trading_days * 365 / 252) + 7
+
+
+def compute_indicators(closes, names):
+    """
+    Computes several indicators from one buffer of closing prices
+    closes: closing prices ordered by date ascending
+    names: indicator names eg. ["SMA50", "EMA200", "RSI14", "BB20"]
+    Returns a dict of column name to array aligned with closes, Bollinger bands add _Upper/_Middle/_Lower columns
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    columns = {}
+    for name in names:
+        kind, window = parse_indicator(name)
+        label = f"{kind}{window}"
+        if kind == "SMA":
+            columns[label] = sma(closes, window)
+        elif kind == "EMA":
+            columns[label] = ema(closes, window)
+        elif kind == "RSI":
+            columns[label] = rsi(closes, window)
+        else:
+            upper, middle, lower = bollinger_bands(closes, window)
+            columns[f"{label}_Upper"] = upper
+            columns[f"{label}_Middle"] = middle
+            columns[f"{label}_Lower"] = lower
+    return columns
@@ -0,0 +1,267 @@
+# The purpose of this file is to measure where time goes in the web application and the update jobs
+# Counters, gauges and histograms are kept in memory and rendered in the Prometheus text format, the web application
+# serves them on /metrics and the scheduler can serve them on a port of its own. A sampling profiler can be attached to
+# slow requests to log the stacks they spent their time in.
+
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds, from a cached lookup to a full update run
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        """
+        name: metric name eg. "stock_query_rows_total"
+        help_text: description shown by Prometheus
+        labels: names of the labels every observation has to give
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """Value that only goes up eg. rows read"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, either set directly or read from a function when rendered"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        """function: optional function with no arguments returning the value, for gauges without labels"""
+        super().__init__(name, help_text, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.function is not None:
+            return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}",
+                    f"{self.name} {self.function()}"]
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Distribution of observations eg. latencies, counted into cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return 0 if entry is None else entry[1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, (buckets, count, total) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{_label_text(names, key + (bound,))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_label_text(names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+        return lines
+
+
+def render():
+    """Every metric in the Prometheus text format"""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# warehouse queries made by DW_Stock and StockMetrics
+QUERY_SECONDS = Histogram("stock_query_duration_seconds", "Time spent running a warehouse query and reading its rows",
+                          ["component", "query"])
+QUERY_ROWS = Counter("stock_query_rows_total", "Rows read from or written to the warehouse", ["component", "query"])
+
+# web application
+REQUEST_SECONDS = Histogram("stock_web_request_duration_seconds", "Time spent handling a request", ["route", "status"])
+STAGE_SECONDS = Histogram("stock_web_stage_duration_seconds",
+                          "Time spent in each stage of a request (fetch, compute, render, serialize)", ["route", "stage"])
+SLOW_REQUESTS = Counter("stock_web_slow_requests_total", "Requests slower than the profiling threshold", ["route"])
+
+# update jobs
+UPDATE_FETCH_SECONDS = Histogram("stock_update_fetch_duration_seconds",
+                                 "Time spent downloading one chunk of tickers, retries included", [])
+UPDATE_TICKER_SECONDS = Histogram("stock_update_ticker_latency_seconds",
+                                  "Time spent on one ticker, the download of its chunk plus the write of the batch holding its rows", [])
+UPDATE_TICKERS = Counter("stock_update_tickers_total", "Tickers processed by the update jobs", ["result"])
+JOB_SECONDS = Histogram("stock_job_duration_seconds", "Time taken by a scheduled job", ["job"])
+
+ERRORS = Counter("stock_errors_total", "Errors caught and logged instead of being raised", ["component"])
+
+
+class QueryTimer:
+    """
+    Times a warehouse query and counts its rows
+    eg. with query_timer("StockMetrics", "indicator_frame") as timer:
+            ...
+            timer.rows = len(results)
+    """
+    def __init__(self, component, query):
+        self.component = component
+        self.query = query
+        self.rows = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        QUERY_SECONDS.observe(time.perf_counter() - self.started, component=self.component, query=self.query)
+        QUERY_ROWS.inc(self.rows, component=self.component, query=self.query)
+
+
+def query_timer(component, query):
+    """
+    component: class making the query eg. "DW_Stock"
+    query: method or purpose of the query eg. "dw_std_query"
+    """
+    return QueryTimer(component, query)
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005, depth=12):
+        """
+        Records the stack of one thread at a fixed interval from a background thread
+        thread_id: threading.get_ident() of the thread to sample
+        interval: seconds between samples
+        depth: innermost frames kept per sample
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.depth = depth
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.depth)
+            self.samples[tuple(f"{entry.filename}:{entry.lineno} {entry.name}" for entry in stack)] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def report(self, top=5):
+        """The stacks seen most often, innermost frame last"""
+        total = sum(self.samples.values()) or 1
+        lines = []
+        for stack, count in self.samples.most_common(top):
+            lines.append(f"{count / total:.0%} of {total} samples:")
+            lines.extend(f"    {frame}" for frame in stack)
+        return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="0.0.0.0"):
+    """
+    Serves the metrics on their own port from a background thread, for processes without the web application
+    eg. the scheduler running the update jobs
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on port %s", server.server_address[1])
+    return server
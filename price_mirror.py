@@ -0,0 +1,304 @@
+# The purpose of this file is to keep a local copy of StockInformation that can be read without going through the database
+# Every ticker gets one raw file per column (Date, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume) holding the values in
+# date order, and index.json records how many rows each ticker has. Files are opened as NumPy memory maps so a date range
+# is a slice of the mapped file rather than a copy of database rows. The mirror is refreshed for every ticker the registry
+# reports as written, so DW_Stock's loads and updates keep it current.
+# Build or catch up the whole mirror with python price_mirror.py
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, msvcrt locks byte ranges instead
+    fcntl = None
+    import msvcrt
+
+from connection_pool import load_config
+from storage_backends import PRICE_COLUMNS
+from ticker_registry import get_registry
+
+# columns mirrored for every ticker and how they are stored on disk
+FIELDS = PRICE_COLUMNS[1:]
+DTYPES = {field: np.dtype("<f8") for field in FIELDS}
+DTYPES["Date"] = np.dtype("<M8[D]")
+
+INDEX_FILE = "index.json"
+# held with an OS lock while writing, the OS releases it when the holding process exits or crashes
+LOCK_FILE = "mirror.lock"
+
+
+class PriceMirror:
+    def __init__(self, backend, path, overlap_days=30):
+        """
+        backend: storage backend holding the warehouse
+        path: directory the mirror is kept in, created if it does not exist
+        overlap_days: calendar days before a ticker's last mirrored date that are read again on refresh, so rows the
+                      warehouse repaired or revised are picked up
+        """
+        self.backend = backend
+        self.path = path
+        self.overlap_days = overlap_days
+        self._index = {}
+        self._index_mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    # reading
+
+    def _entries(self):
+        """Index of ticker to {"rows", "first", "last", "generation"}, read again when another process rewrote it"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            mtime = os.stat(index_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._index_mtime:
+            with open(index_path) as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _file(self, ticker, field, generation):
+        return os.path.join(self.path, ticker, f"{field}.{generation}.bin")
+
+    def _array(self, ticker, field, entry):
+        """Read only memory map of one column of a ticker"""
+        if entry["rows"] == 0:
+            return np.empty(0, dtype=DTYPES[field])
+        return np.memmap(self._file(ticker, field, entry["generation"]), dtype=DTYPES[field], mode="r",
+                         shape=(entry["rows"],))
+
+    def contains(self, ticker):
+        """Whether the ticker is in the mirror"""
+        return ticker in self._entries()
+
+    def last_date(self, ticker):
+        """Latest mirrored date of a ticker as a datetime.date, None when it is not mirrored"""
+        entry = self._entries().get(ticker)
+        return None if entry is None else pd.Timestamp(entry["last"]).date()
+
+    def columns(self, ticker, start_date=None, end_date=None, fields=FIELDS):
+        """
+        Columns of a ticker between two dates without copying them
+        ticker: ticker name eg "AAPL"
+        start_date, end_date: dates returned, both ends included, None leaves that end open
+        fields: columns returned eg. ["Date", "ClosePrice"]
+        Returns a dict of column name to read only array, or None when the ticker is not mirrored
+        """
+        entry = self._entries().get(ticker)
+        if entry is None:
+            return None
+        dates = self._array(ticker, "Date", entry)
+        # the dates are sorted so the range is found with two binary searches
+        lo = 0 if start_date is None else int(np.searchsorted(dates, _day(start_date), side="left"))
+        hi = len(dates) if end_date is None else int(np.searchsorted(dates, _day(end_date), side="right"))
+        return {field: (dates if field == "Date" else self._array(ticker, field, entry))[lo:hi] for field in fields}
+
+    def frame(self, ticker, start_date=None, end_date=None):
+        """
+        Prices of a ticker between two dates as a DataFrame shaped like the rows of StockInformation
+        Returns None when the ticker is not mirrored
+        """
+        columns = self.columns(ticker, start_date, end_date)
+        if columns is None:
+            return None
+        df = pd.DataFrame({field: np.asarray(values) for field, values in columns.items()})
+        df["Date"] = columns["Date"].tolist()
+        df["Volume"] = df["Volume"].astype("int64")
+        return df
+
+    # writing
+
+    @contextlib.contextmanager
+    def _writer(self):
+        """Only one thread in one process writes to the mirror at a time"""
+        # the file is never removed, deleting it would let a waiting process lock a file nobody else opens again
+        fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_CREAT | os.O_RDWR)
+        try:
+            with self._lock:
+                _lock_file(fd)
+                try:
+                    # another process may have written since this one last looked
+                    self._index_mtime = None
+                    index = dict(self._entries())
+                    yield index
+                    self._save_index(index)
+                finally:
+                    _unlock_file(fd)
+        finally:
+            os.close(fd)
+
+    def _save_index(self, index):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(temp_path, index_path)
+        self._index = index
+        self._index_mtime = os.stat(index_path).st_mtime_ns
+
+    def _query(self, cursor, ticker, since=None):
+        """Rows of a ticker from the warehouse as a dict of column arrays"""
+        statement = f"SELECT {', '.join(FIELDS)} FROM {{StockInformation}} s WHERE s.TickerSymbol = ?"
+        params = [ticker]
+        if since is not None:
+            statement += " AND s.Date >= ?"
+            params.append(since)
+        cursor.execute(self.backend.sql(statement + " ORDER BY Date ASC"), params)
+        results = cursor.fetchall()
+        columns = {"Date": np.array([_day(row[0]) for row in results], dtype=DTYPES["Date"])}
+        for i, field in enumerate(FIELDS[1:], start=1):
+            columns[field] = np.fromiter((np.nan if row[i] is None else row[i] for row in results),
+                                         dtype=np.float64, count=len(results))
+        return columns
+
+    def _rebuild(self, cursor, ticker, entry):
+        """Writes a new generation of a ticker's files from its full history and drops the old one"""
+        columns = self._query(cursor, ticker)
+        generation = 0 if entry is None else entry["generation"] + 1
+        os.makedirs(os.path.join(self.path, ticker), exist_ok=True)
+        for field in FIELDS:
+            columns[field].tofile(self._file(ticker, field, generation))
+        if entry is not None:
+            # readers still mapping the old files keep them alive, and some platforms refuse the removal until they are done
+            for field in FIELDS:
+                with contextlib.suppress(OSError):
+                    os.remove(self._file(ticker, field, entry["generation"]))
+        return _entry(columns["Date"], len(columns["Date"]), generation)
+
+    def _extend(self, cursor, ticker, entry):
+        """
+        Reads the ticker's rows from overlap_days before its last mirrored date, writes revised values in place and
+        appends the new dates. Returns None when the warehouse has dates the mirror does not, so it has to be rebuilt
+        """
+        since = pd.Timestamp(entry["last"]).date() - pd.Timedelta(days=self.overlap_days)
+        fetched = self._query(cursor, ticker, since)
+        dates = self._array(ticker, "Date", entry)
+        position = int(np.searchsorted(dates, _day(since), side="left"))
+        existing = np.array(dates[position:])
+        overlap = len(existing)
+        if len(fetched["Date"]) < overlap or (fetched["Date"][:overlap] != existing).any():
+            return None
+
+        for field in FIELDS:
+            # existing rows are rewritten in place and new rows appended, the files are never shortened so readers
+            # mapping them are never left pointing past the end
+            with open(self._file(ticker, field, entry["generation"]), "r+b") as f:
+                f.seek(position * DTYPES[field].itemsize)
+                fetched[field].tofile(f)
+        rows = position + len(fetched["Date"])
+        return _entry(fetched["Date"] if len(fetched["Date"]) else dates, rows, entry["generation"],
+                      first=entry["first"])
+
+    def refresh(self, tickers=None):
+        """
+        Brings the mirror up to date with the warehouse
+        tickers: tickers to refresh, defaults to every ticker in the registry
+        Returns the number of tickers whose files were rewritten from scratch
+        """
+        started = time.perf_counter()
+        registry = get_registry(self.backend).entries(tickers)
+        rebuilt = 0
+        with self._writer() as index, self.backend.pool.connection() as conn:
+            cursor = conn.cursor()
+            for ticker, (_, _, day_count, _) in registry.items():
+                entry = index.get(ticker)
+                updated = self._extend(cursor, ticker, entry) if entry is not None and entry["rows"] else None
+                # a hole filled further back than the overlap changes the row count, the files are rebuilt to take it in
+                if updated is None or (day_count is not None and updated["rows"] != day_count):
+                    updated = self._rebuild(cursor, ticker, entry)
+                    rebuilt += 1
+                index[ticker] = updated
+        elapsed = time.perf_counter() - started
+        print(f"Mirror refreshed for {len(registry)} stocks, {rebuilt} rebuilt in {elapsed:.2f}s")
+        return rebuilt
+
+    def forget(self, tickers):
+        """Drops tickers from the index so reads for them go back to the warehouse"""
+        with self._writer() as index:
+            for ticker in tickers:
+                index.pop(ticker, None)
+
+    def _on_written(self, tickers):
+        """Registry callback run after new rows were written for the tickers"""
+        try:
+            self.refresh(tickers)
+        except Exception as e:
+            print(f"Mirror refresh failed, reading these stocks from the warehouse instead: {e}")
+            with contextlib.suppress(Exception):
+                self.forget(tickers)
+
+
+def _lock_file(fd):
+    """Blocks until this process holds the OS lock on an open file"""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    # msvcrt locks the byte at the current position and gives up after ten seconds, so it is asked again until free
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def _unlock_file(fd):
+    """Releases the lock taken by _lock_file"""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _day(value):
+    """Converts a date, datetime or ISO string to a numpy day"""
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+def _entry(dates, rows, generation, first=None):
+    """Index entry for a ticker's files"""
+    return {
+        "rows": int(rows),
+        "first": first if first is not None else (str(dates[0]) if len(dates) else None),
+        "last": str(dates[-1]) if len(dates) else None,
+        "generation": generation,
+    }
+
+
+def get_mirror(backend):
+    """
+    Returns the mirror shared by everything in the process using the given backend
+    None when mirror_path is not set in the Data Warehouse section of the configuration file
+    """
+    return backend.shared("mirror", lambda: _build_mirror(backend))
+
+
+def _build_mirror(backend):
+    section = load_config()["Data Warehouse"]
+    path = section.get("mirror_path", "").strip()
+    if not path:
+        return None
+    mirror = PriceMirror(backend, path, overlap_days=section.getint("sync_repair_days", 30))
+    # the mirror has to be current before caches built on it are told to reload
+    get_registry(backend).subscribe(mirror._on_written, first=True)
+    return mirror
+
+
+if __name__ == "__main__":
+    from storage_backends import get_backend
+    mirror = get_mirror(get_backend())
+    if mirror is None:
+        print("Set mirror_path in the Data Warehouse section of the configuration file first")
+    else:
+        mirror.refresh()
@@ -0,0 +1,321 @@
+# The purpose of this file is to keep weekly and monthly OHLCV bars of every stock next to the daily prices
+# StockWeekly and StockMonthly are rebuilt for the periods a write touched whenever the ticker registry reports new rows,
+# so a long range can be read as a few hundred bars instead of thousands of days. query picks the finest resolution
+# that fits a point budget and thins the result with Largest-Triangle-Three-Buckets when even monthly bars are too many.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from connection_pool import load_config
+from instrumentation import query_timer
+from storage_backends import PRICE_COLUMNS, QUERY_CHUNK, ROLLUP_COLUMNS
+from ticker_registry import get_registry
+
+# resolutions from finest to coarsest and the table holding each, daily prices are read from StockInformation
+RESOLUTIONS = ["daily", "weekly", "monthly"]
+ROLLUP_TABLES = {"weekly": "StockWeekly", "monthly": "StockMonthly"}
+
+# tickers whose whole history is rolled up are read a few at a time to bound the memory used
+HISTORY_CHUNK = 50
+
+# points returned by query when no budget is given, about what a chart can show across a screen
+DEFAULT_MAX_POINTS = 1000
+
+
+def week_start(days):
+    """Monday of the week of each date, days is a datetime64 array"""
+    days = days.astype("datetime64[D]")
+    # 1970-01-01 was a Thursday, so shifting by 3 makes Monday day 0 of every week
+    return days - ((days.astype(np.int64) + 3) % 7)
+
+
+def month_start(days):
+    """First day of the month of each date, days is a datetime64 array"""
+    return days.astype("datetime64[M]").astype("datetime64[D]")
+
+
+# first day of the period each date falls in, by resolution
+PERIOD_START = {"weekly": week_start, "monthly": month_start}
+
+
+def aggregate(df, resolution):
+    """
+    Rolls daily prices up into one bar per ticker and period
+    df: DataFrame with TickerSymbol, Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns ordered by date
+    resolution: "weekly" or "monthly"
+    Returns a DataFrame with the ROLLUP_COLUMNS
+    """
+    days = pd.to_datetime(df["Date"]).to_numpy()
+    grouped = df.assign(Date=days, PeriodStart=PERIOD_START[resolution](days)).groupby(["TickerSymbol", "PeriodStart"], sort=True)
+    bars = grouped.agg(
+        PeriodEnd=("Date", "max"),
+        OpenPrice=("OpenPrice", "first"),
+        ClosePrice=("ClosePrice", "last"),
+        HighPrice=("HighPrice", "max"),
+        LowPrice=("LowPrice", "min"),
+        Volume=("Volume", "sum"),
+        DayCount=("Date", "count"),
+    ).reset_index()
+    return bars[ROLLUP_COLUMNS]
+
+
+def _bar_rows(bars):
+    """Row tuples for the rollup tables as plain python values the database drivers understand"""
+    columns = [
+        bars["TickerSymbol"].tolist(),
+        pd.to_datetime(bars["PeriodStart"]).dt.date.tolist(),
+        pd.to_datetime(bars["PeriodEnd"]).dt.date.tolist(),
+    ]
+    for column in ["OpenPrice", "ClosePrice", "HighPrice", "LowPrice"]:
+        values = bars[column].astype(float)
+        columns.append([None if value != value else value for value in values.tolist()])
+    columns.append(bars["Volume"].fillna(0).astype("int64").tolist())
+    columns.append(bars["DayCount"].astype("int64").tolist())
+    return list(zip(*columns))
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling, keeps the points that preserve the shape of a line chart
+    x: increasing positions eg. dates as day numbers
+    y: values at those positions eg. closing prices
+    threshold: number of points kept, the first and last point are always kept
+    Returns the indices of the kept points in increasing order
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    # gaps in the series must not win every triangle, they are bridged with the last value seen
+    y = pd.Series(np.asarray(y, dtype=np.float64)).ffill().bfill().to_numpy()
+
+    # the points between the first and the last are split into threshold - 2 buckets and one point is kept per bucket
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # the third corner of the triangle is the average of the next bucket, or the last point for the last bucket
+        following = slice(stop, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        average_x, average_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[a] - average_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (average_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def estimate_points(start, end, resolution):
+    """
+    Number of points a resolution returns between two dates, without reading them
+    Weekdays stand in for trading days so holidays make the daily figure a slight overestimate
+    """
+    if start > end:
+        return 0
+    if resolution == "daily":
+        return int(np.busday_count(start, end + datetime.timedelta(days=1)))
+    first, last = PERIOD_START[resolution](np.array([start, end], dtype="datetime64[D]"))
+    if resolution == "weekly":
+        return int((last - first).astype(np.int64)) // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+class Rollups:
+    def __init__(self, backend, repair_days=30):
+        """
+        backend: storage backend holding the warehouse
+        repair_days: how far back a write may have changed existing days, the periods covering them are rebuilt
+        """
+        self.backend = backend
+        self.pool = backend.pool
+        self.registry = get_registry(backend)
+        self.repair_days = repair_days
+
+    def high_water_marks(self, tickers=None):
+        """
+        First day of the latest monthly bar of every ticker
+        Returns a dict of ticker to datetime.date
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql("""
+                SELECT TickerSymbol, MAX(PeriodStart)
+                FROM {StockMonthly}
+                GROUP BY TickerSymbol
+            """))
+            data = cursor.fetchall()
+        marks = {ticker: pd.Timestamp(start).date() for ticker, start in data}
+        if tickers is not None:
+            marks = {ticker: marks[ticker] for ticker in tickers if ticker in marks}
+        return marks
+
+    def refresh(self, tickers=None, full=False, batch_size=None):
+        """
+        Rebuilds the weekly and monthly bars of the periods that may have changed
+        Tickers with bars only have the months from their latest bar, or from repair_days ago when that is earlier,
+        read again, new tickers have their whole history rolled up
+        tickers: tickers that were written to, defaults to every ticker in the registry
+        full: roll up the whole history of every ticker instead
+        batch_size: rows written per batch, defaults to bulk_batch_size in the configuration file
+        Returns the number of bars written
+        """
+        batch_size = batch_size or load_config()["Data Warehouse"].getint("bulk_batch_size", 5000)
+        tickers = list(self.registry.entries(tickers))
+        marks = {} if full else self.high_water_marks(tickers)
+        repair_start = datetime.date.today() - datetime.timedelta(days=self.repair_days)
+
+        # tickers are read together with the others that start from the same month
+        groups = {}
+        for ticker in tickers:
+            since = min(marks[ticker], repair_start) if ticker in marks else None
+            if since is not None:
+                since = since.replace(day=1)
+            groups.setdefault(since, []).append(ticker)
+
+        written = 0
+        for since, group in groups.items():
+            size = QUERY_CHUNK if since is not None else HISTORY_CHUNK
+            for i in range(0, len(group), size):
+                df = self._daily_rows(group[i:i + size], since)
+                if df.empty:
+                    continue
+                for resolution, table in ROLLUP_TABLES.items():
+                    bars = aggregate(df, resolution)
+                    if since is not None:
+                        # the first week read can start in the previous month, its bars would only cover part of it
+                        bars = bars[bars["PeriodStart"] >= pd.Timestamp(PERIOD_START[resolution](np.datetime64(since, "D")))]
+                    written += self._write(table, _bar_rows(bars), batch_size)
+        return written
+
+    def _daily_rows(self, tickers, since):
+        """Daily prices of the tickers from the Monday of the week since falls in, or their whole history"""
+        statement = f"""
+            SELECT TickerSymbol, {', '.join(PRICE_COLUMNS[1:])}
+            FROM {{StockInformation}} s
+            WHERE s.TickerSymbol IN ({', '.join('?' * len(tickers))})
+        """
+        params = list(tickers)
+        if since is not None:
+            # whole weeks are read so the week the month starts in is rebuilt in full as well
+            statement += " AND s.Date >= ?"
+            params.append(pd.Timestamp(week_start(np.datetime64(since, "D"))).date())
+        with query_timer("Rollups", "daily_rows") as timer, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql(statement + " ORDER BY TickerSymbol, Date"), params)
+            results = cursor.fetchall()
+            timer.rows = len(results)
+        return pd.DataFrame.from_records([tuple(row) for row in results], columns=PRICE_COLUMNS)
+
+    def _write(self, table, rows, batch_size):
+        with query_timer("Rollups", "write") as timer, self.pool.connection() as conn:
+            for batch_start in range(0, len(rows), batch_size):
+                self.backend.upsert_rows(conn, table, ["TickerSymbol", "PeriodStart"], ROLLUP_COLUMNS, rows[batch_start:batch_start + batch_size])
+                conn.commit()
+            timer.rows = len(rows)
+        return len(rows)
+
+    def bars(self, ticker, start_date, end_date, resolution):
+        """
+        Bars of one ticker overlapping the dates, the first and last bar can include days outside them
+        resolution: "daily", "weekly" or "monthly"
+        Returns a DataFrame with Date (the first day of each bar), OpenPrice, ClosePrice, HighPrice, LowPrice, Volume,
+        PeriodEnd and DayCount columns ordered by date
+        """
+        if resolution == "daily":
+            statement = """
+                SELECT Date, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume, Date, 1
+                FROM {StockInformation} s
+                WHERE s.TickerSymbol = ? AND s.Date BETWEEN ? AND ?
+                ORDER BY Date ASC
+            """
+        else:
+            statement = f"""
+                SELECT PeriodStart, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume, PeriodEnd, DayCount
+                FROM {{{ROLLUP_TABLES[resolution]}}} r
+                WHERE r.TickerSymbol = ? AND r.PeriodEnd >= ? AND r.PeriodStart <= ?
+                ORDER BY PeriodStart ASC
+            """
+        with query_timer("Rollups", resolution) as timer, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql(statement), (ticker, start_date, end_date))
+            results = cursor.fetchall()
+            timer.rows = len(results)
+        return pd.DataFrame.from_records([tuple(row) for row in results],
+                                         columns=["Date", "OpenPrice", "ClosePrice", "HighPrice", "LowPrice", "Volume",
+                                                  "PeriodEnd", "DayCount"])
+
+    def choose_resolution(self, ticker, start_date, end_date, max_points=DEFAULT_MAX_POINTS):
+        """
+        Finest resolution whose points between the dates fit in max_points, monthly when none of them do
+        The dates are first narrowed to the ticker's history in the registry
+        """
+        entry = self.registry.entries([ticker]).get(ticker)
+        if entry is not None and entry[0] is not None:
+            start_date, end_date = max(start_date, entry[0]), min(end_date, entry[1])
+        for resolution in RESOLUTIONS:
+            if estimate_points(start_date, end_date, resolution) <= max_points:
+                return resolution
+        return RESOLUTIONS[-1]
+
+    def query(self, ticker, start_date, end_date, max_points=DEFAULT_MAX_POINTS, resolution=None, downsample=True):
+        """
+        Price history of a ticker sized for a chart
+        ticker: ticker name eg "AAPL"
+        start_date, end_date: dates covered
+        max_points: most points wanted back
+        resolution: "daily", "weekly" or "monthly", defaults to the finest one that fits max_points
+        downsample: thin the bars with LTTB on the closing price when there are still more than max_points of them
+        Returns (resolution, downsampled, DataFrame) with the DataFrame laid out like bars
+        """
+        if resolution is None:
+            resolution = self.choose_resolution(ticker, start_date, end_date, max_points)
+        elif resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, expected one of {', '.join(RESOLUTIONS)}")
+        df = self.bars(ticker, start_date, end_date, resolution)
+        if df.empty and resolution != "daily" and self.registry.contains(ticker) and not self.high_water_marks([ticker]):
+            # bars are only missing for tickers loaded before the rollup tables existed, building them once is enough
+            if self.refresh([ticker]):
+                df = self.bars(ticker, start_date, end_date, resolution)
+
+        downsampled = False
+        if downsample and len(df) > max_points:
+            days = pd.to_datetime(df["Date"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+            df = df.iloc[lttb(days, df["ClosePrice"].astype(float).to_numpy(), max_points)].reset_index(drop=True)
+            downsampled = True
+        return resolution, downsampled, df
+
+    def _on_written(self, tickers):
+        """Registry callback run after new rows were written for the tickers"""
+        try:
+            self.refresh(tickers)
+        except Exception as e:
+            # the bars catch up on the next write, rollups.py can rebuild them in full
+            print(f"Rollup refresh failed: {e}")
+
+
+def get_rollups(backend):
+    """
+    Returns the rollups shared by everything in the process using the given backend
+    They are kept up to date through the ticker registry from the first call on
+    """
+    return backend.shared("rollups", lambda: _build_rollups(backend))
+
+
+def _build_rollups(backend):
+    rollups = Rollups(backend, repair_days=load_config()["Data Warehouse"].getint("sync_repair_days", 30))
+    # the bars have to be current before caches built on them are told to reload
+    get_registry(backend).subscribe(rollups._on_written, first=True)
+    return rollups
+
+
+if __name__ == "__main__":
+    from storage_backends import get_backend
+    started = datetime.datetime.now()
+    bars = get_rollups(get_backend()).refresh(full=True)
+    print(f"Rolled up every stock, {bars} bars written in {(datetime.datetime.now() - started).total_seconds():.2f}s")
@@ -2,26 +2,50 @@
 # Last Edited: 2025-03-24
 # The purpose of this file is to calculate helpful stock metrics given a SQL database is already set up
 
-import pyodbc
 import datetime
-import statistics # just to use standard deviation
-import configparser
+import numpy as np
+import pandas as pd
+import indicators
+from instrumentation import query_timer
+from price_mirror import get_mirror
+from storage_backends import INDICATOR_COLUMNS, get_backend
 
 class StockMetrics:
-    def __init__(self):
-        # retrieve SQL database configuration from config file
-        config = configparser.ConfigParser()
-        config.read("configs\config.ini")
-        # setting up the connection to the data warehouse
-        self.conn = pyodbc.connect(driver='{SQL Server Native Client 11.0}',
-                              server=config["Data Warehouse"]["server"],
-                              database=config["Data Warehouse"]["database"],
-                              uid=config["Data Warehouse"]["username"],
-                              pwd=config["Data Warehouse"]["password"])
-        self.cur = self.conn.cursor()
+    def __init__(self, backend=None):
+        """
+        backend: storage backend holding the warehouse, defaults to the one in the configuration file
+        """
+        self.backend = backend if backend is not None else get_backend()
+        # connections to the data warehouse are borrowed from the backend's pool for each query
+        self.pool = self.backend.pool
+        # prices are sliced out of the local mirror when one is configured instead of being queried
+        self.mirror = get_mirror(self.backend)
         self.c_price_plot = []
         self.dates_plot = []
 
+    def _closing_prices(self, ticker, start_date, end_date):
+        """
+        Queries the dates and closing prices of a ticker ordered by date
+        Returns the dates as a list and the closing prices as a float64 array
+        """
+        if self.mirror is not None:
+            columns = self.mirror.columns(ticker, start_date, end_date, ["Date", "ClosePrice"])
+            if columns is not None:
+                return columns["Date"].tolist(), columns["ClosePrice"]
+        select_statement = self.backend.sql("""
+        SELECT Date, ClosePrice
+        FROM {StockInformation} s
+        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
+        ORDER BY Date ASC
+        """)
+        with query_timer("StockMetrics", "closing_prices") as timer, self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(select_statement, (start_date, end_date, ticker))
+            results = cur.fetchall()
+            timer.rows = len(results)
+        dates, closing_price = indicators.as_arrays(results)
+        return dates.tolist(), closing_price
+
     def simple_moving_average(self, ticker, start_date, end_date, window_size):
         """
         Calculates the simple moving average over a period of time set by the user
@@ -30,42 +54,19 @@ class StockMetrics:
         end_date: End date of the function consideration
         window_size: how long the simple moving average is averaging over
         """
-        select_statement = """
-        SELECT Date, ClosePrice
-        FROM StockInformation s
-        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
-        ORDER BY Date ASC
-        """
         #setting the ticker to avoid confusion if we even mix functions
         self.ticker = ticker
-
-        # querying database for the data
-        self.cur.execute(select_statement, start_date, end_date, ticker)
-        results = self.cur.fetchall()
-
-        # allocating space for the data 
-        closing_price = [None] * len(results) 
-        dates = [None] * len(results)
-        # appending the closing results to the empty arrays declared above
-        for i in range(len(results)):
-            dates[i] = results[i][0]
-            closing_price[i] = results[i][1]
+        dates, closing_price = self._closing_prices(ticker, start_date, end_date)
 
         # copying the data over to use this data later in other functions
-        self.c_price_plot = closing_price.copy()
+        self.c_price_plot = closing_price.tolist()
         self.dates_plot = dates.copy()
 
         # plot_line is essentially the SMA combined with dates can be plotted
-        plot_line = [None]*(len(closing_price) - window_size)
-        plot_date = [None]*(len(closing_price) - window_size)
-        window_start, window_end = 0, window_size
-        # 2 pointers approach
-        while window_end <= len(closing_price)-1:
-            # aggregating the results based on the window size
-            plot_date[window_start] = dates[window_end-1]
-            plot_line[window_start] = sum(closing_price[window_start: window_end])/window_size
-            window_start += 1
-            window_end += 1
+        # the windows end one day before the last close to stay in line with the original two pointer version
+        last = len(closing_price) - 1
+        plot_line = indicators.sma(closing_price, window_size)[window_size-1:last].tolist()
+        plot_date = dates[window_size-1:last]
 
         return self.c_price_plot, self.dates_plot, plot_line, plot_date
 
@@ -77,67 +78,27 @@ class StockMetrics:
         end_date: End date of the function consideration
         window_size: how long the simple moving average is averaging over
         """
-        select_statement = """
-        SELECT Date, ClosePrice
-        FROM StockInformation s
-        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
-        ORDER BY Date ASC
-        """
-        self.cur.execute(select_statement, start_date, end_date, ticker)
-        results = self.cur.fetchall()
-
-        closing_price = [None] * len(results) # x on our plot
-        dates = [None] * len(results) # the y on our plot
-        # appending the closing results to the empty arrays declared above
-        for i in range(len(results)):
-            dates[i] = results[i][0]
-            closing_price[i] = results[i][1]
+        dates, closing_price = self._closing_prices(ticker, start_date, end_date)
 
-        plot_line = [None]*(len(closing_price))
-        plot_line[0] = closing_price[0]
-        iterator = 1
+        # the smoothing factor has always been 1 / (2/window + 1), kept so the plotted lines do not change
+        plot_line = indicators.ema(closing_price, window_size, alpha=1/(2/window_size + 1)).tolist()
 
-        while iterator <= len(results)-1:
-            # aggregating the results based on the window size
-            plot_line[iterator] = (closing_price[iterator] - plot_line[iterator-1])/(2/window_size + 1) + plot_line[iterator-1]
-            iterator += 1
+        return closing_price.tolist(), dates, plot_line
 
-        return closing_price, dates, plot_line
-
-    def reletive_strength_index(self, ticker, start_date, end_date):
+    def reletive_strength_index(self, ticker, start_date, end_date, period=14):
         """
-        Calculates the RSI index over a period of time set by the user
+        Calculates Wilder's RSI at the end of a period of time set by the user
         ticker: ticker name eg "AAPL"
         start_date: Start date of the function consideration
         end_date: End date of the function consideration
+        period: how many days the gains and losses are smoothed over
         """
-        select_statement = """
-        SELECT Date, ClosePrice
-        FROM StockInformation s
-        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
-        ORDER BY Date ASC
-        """
-        self.cur.execute(select_statement, start_date, end_date, ticker)
-        results = self.cur.fetchall()
-
-        closing_price = [None] * len(results) # x on our plot
-        gain = []
-        loss = []
-        dates = [None] * len(results) # the y on our plot
-        persistent = 0
-        # appending the closing results to the empty arrays declared above
-        for i in range(len(results)):
-            dates[i] = results[i][0]
-            if results[i][1] > persistent:
-                gain.append(results[i][1])
-                persistent = results[i][1]
-            else:
-                loss.append(results[i][1])
-                persistent = results[i][1]
-        gain_average = sum(gain)/len(gain)
-        loss_average = sum(loss)/len(loss)
-
-        return round(100 - (100/(1+(gain_average/loss_average))), 4)
+        _, closing_price = self._closing_prices(ticker, start_date, end_date)
+        strength = indicators.rsi(closing_price, period)
+        if len(strength) == 0 or np.isnan(strength[-1]):
+            return None
+
+        return round(float(strength[-1]), 4)
 
     def bollinger_bands(self, ticker, start_date, end_date):
         """
@@ -147,20 +108,110 @@ class StockMetrics:
         end_date: End date of the function consideration
         """
         closing_p, c_date, SMA, s_dates = self.simple_moving_average(ticker, start_date, end_date, 20)
-        start, end = 0, 20
-        deviate_rates = [None] * (len(closing_p) - 20)
-        while end < len(SMA):
-            deviate_rates[start] = statistics.stdev(closing_p[start:end])
-            start += 1
-            end += 1
-        upper = [None] * (len(closing_p) - 20)
-        lower = [None] * (len(closing_p) - 20)
-        for i in range(len(SMA)):
-            upper[i] = SMA[i] + 2 * deviate_rates[i]
-            lower[i] = SMA[i] - 2 * deviate_rates[i]
+        # the standard deviation uses the same windows as the SMA above
+        deviate_rates = indicators.rolling_std(closing_p, 20)[19:19 + len(SMA)]
+        upper = (np.array(SMA) + 2 * deviate_rates).tolist()
+        lower = (np.array(SMA) - 2 * deviate_rates).tolist()
 
         return upper, lower, SMA, s_dates
-     
+
+    def indicator_frame(self, ticker, indicator_names, days=365, end_date=None):
+        """
+        Calculates several indicators for a ticker from a single query
+        ticker: ticker name eg "AAPL"
+        indicator_names: indicators to add as columns eg ["SMA50", "EMA200", "RSI14", "BB20"]
+        days: how many calendar days before end_date are returned
+        end_date: last date returned, defaults to today
+        Returns a DataFrame ordered by date with the prices and one column per indicator
+        """
+        if end_date is None:
+            end_date = datetime.date.today()
+        display_start = end_date - datetime.timedelta(days=days)
+        # fetching the widest range any of the indicators needs so they are all computed from the same buffer
+        fetch_start = display_start - datetime.timedelta(days=indicators.lookback_days(indicator_names))
+        df = self.price_frame(ticker, fetch_start, end_date)
+        return self.add_indicators(df, indicator_names, display_start)
+
+    def price_frame(self, ticker, start_date, end_date):
+        """
+        Daily prices of a ticker from the mirror when it holds the ticker, otherwise from the warehouse
+        Returns a DataFrame with Date, OpenPrice, ClosePrice, HighPrice, LowPrice and Volume columns ordered by date
+        """
+        df = self.mirror.frame(ticker, start_date, end_date) if self.mirror is not None else None
+        if df is not None:
+            return df
+        select_statement = self.backend.sql("""
+        SELECT Date, OpenPrice, ClosePrice, HighPrice, LowPrice, Volume
+        FROM {StockInformation} s
+        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
+        ORDER BY Date ASC
+        """)
+        with query_timer("StockMetrics", "price_frame") as timer, self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(select_statement, (start_date, end_date, ticker))
+            results = cur.fetchall()
+            timer.rows = len(results)
+        return pd.DataFrame.from_records([tuple(row) for row in results],
+                                         columns=['Date', 'OpenPrice', 'ClosePrice', 'HighPrice', 'LowPrice', 'Volume'])
+
+    def add_indicators(self, df, indicator_names, display_start=None):
+        """
+        Adds one column per indicator to a frame from price_frame
+        display_start: first date kept, the rows before it are only used to warm up the indicators
+        """
+        df['ClosePrice'] = df['ClosePrice'].astype(float)
+        for column, values in indicators.compute_indicators(df['ClosePrice'].to_numpy(), indicator_names).items():
+            df[column] = values
+
+        # dropping the warm up rows that were only needed for the indicators
+        if display_start is not None:
+            df = df[pd.to_datetime(df['Date']) >= pd.Timestamp(display_start)]
+        return df.reset_index(drop=True)
+
+    def materialized_frame(self, ticker, indicator_names, days=365, end_date=None):
+        """
+        Same frame as indicator_frame but read from the StockIndicators table filled by indicator_job.py
+        ticker: ticker name eg "AAPL"
+        indicator_names: indicators to add as columns eg ["SMA50", "EMA200"]
+        days: how many calendar days before end_date are returned
+        end_date: last date returned, defaults to today
+        Returns None when an indicator is not materialized or the table is behind the prices
+        """
+        columns = []
+        for name in indicator_names:
+            kind, _ = indicators.parse_indicator(name)
+            columns.extend([f"{name}_Upper", f"{name}_Middle", f"{name}_Lower"] if kind == "BB" else [name])
+        if any(column not in INDICATOR_COLUMNS for column in columns):
+            return None
+
+        select_statement = self.backend.sql(f"""
+        SELECT s.Date, s.OpenPrice, s.ClosePrice, s.HighPrice, s.LowPrice, s.Volume, i.Date{''.join(', i.' + column for column in columns)}
+        FROM {{StockInformation}} s
+        LEFT JOIN {{StockIndicators}} i ON i.TickerSymbol = s.TickerSymbol AND i.Date = s.Date
+        WHERE s.Date BETWEEN ? AND ? AND s.TickerSymbol = ?
+        ORDER BY s.Date ASC
+        """)
+        if end_date is None:
+            end_date = datetime.date.today()
+        display_start = end_date - datetime.timedelta(days=days)
+        with query_timer("StockMetrics", "materialized_frame") as timer, self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(select_statement, (display_start, end_date, ticker))
+            results = cur.fetchall()
+            timer.rows = len(results)
+
+        df = pd.DataFrame.from_records([tuple(row) for row in results],
+                                       columns=['Date', 'OpenPrice', 'ClosePrice', 'HighPrice', 'LowPrice', 'Volume',
+                                                'IndicatorDate'] + columns)
+        # a price row without its indicator row means the job has not caught up with the latest sync
+        if df.empty or df['IndicatorDate'].isna().any():
+            return None
+        df = df.drop(columns='IndicatorDate')
+        df['ClosePrice'] = df['ClosePrice'].astype(float)
+        for column in columns:
+            df[column] = df[column].astype(float)
+        return df
+
 if __name__ == "__main__":
     test = StockMetrics()
     nums1, dat1, num2, dat2 = test.simple_moving_average("AAPL", "2022-01-01", "2022-01-31", 7)
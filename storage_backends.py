@@ -0,0 +1,520 @@
+# The purpose of this file is to hide which database engine holds the data warehouse
+# DW_Stock and StockMetrics write their SQL with {StockInformation} style placeholders and the backend fills in the table names,
+# opens the connections and creates the tables. SQL Server is the production warehouse, SQLite and DuckDB are embedded
+# engines for local analytics and benchmarking that avoid a network round trip on every query.
+
+import atexit
+import datetime
+import os
+import sqlite3
+import threading
+
+from connection_pool import ConnectionPool, load_config
+
+# tables making up the warehouse, used to fill in the {Table} placeholders in the SQL statements
+TABLES = ["StockInformation", "StockTickers", "StockEmptySessions", "StockIndicators", "StockWeekly", "StockMonthly"]
+
+# StockEmptySessions holds sessions a download came back without although the ticker traded after them, eg. a halt or an
+# exchange closure the holiday calendar does not know about, so dw_sync stops asking for them
+
+# weekly and monthly OHLCV aggregates of StockInformation kept by rollups.py, keyed by ticker and first day of the period
+ROLLUP_TABLES = ["StockWeekly", "StockMonthly"]
+ROLLUP_COLUMNS = ["TickerSymbol", "PeriodStart", "PeriodEnd", "OpenPrice", "ClosePrice", "HighPrice", "LowPrice", "Volume", "DayCount"]
+
+# IN lists are split into chunks of this many parameters so they stay well under SQL Server's limit of 2100
+QUERY_CHUNK = 500
+
+# columns of StockInformation written by the load and update paths, StockID is generated by the database
+PRICE_COLUMNS = ["TickerSymbol", "Date", "OpenPrice", "ClosePrice", "HighPrice", "LowPrice", "Volume"]
+
+# precomputed indicator columns of StockIndicators, named the way indicators.compute_indicators names them
+INDICATOR_COLUMNS = ["SMA50", "SMA200", "EMA50", "EMA200", "RSI14", "BB20_Upper", "BB20_Middle", "BB20_Lower"]
+
+
+class StorageBackend:
+    """Base class for the engines the data warehouse can run on"""
+    name = None
+
+    def __init__(self, pool_size=5, pool_timeout=30, check_interval=60):
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.check_interval = check_interval
+        self._pool = None
+        self._lock = threading.Lock()
+        # objects built on this backend and shared by the whole process, see shared
+        self._shared = {}
+        self._shared_lock = threading.RLock()
+
+    @property
+    def pool(self):
+        """Connection pool for this backend, created on first use"""
+        with self._lock:
+            # forked workers must not reuse the parent's sockets
+            if self._pool is None or self._pool.pid != os.getpid():
+                self._pool = ConnectionPool(self.connect, size=self.pool_size, timeout=self.pool_timeout,
+                                            check_interval=self.check_interval)
+                atexit.register(self._pool.close)
+            return self._pool
+
+    def __getstate__(self):
+        # backends are sent to worker processes, each one opens its own connections
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_shared"] = {}
+        del state["_lock"], state["_shared_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._shared_lock = threading.RLock()
+
+    def shared(self, name, factory):
+        """
+        Returns the object kept under name for this backend, built by calling factory on first use
+        Used for the helpers everything in the process shares eg. the ticker registry, they live as long as the backend
+        name: key of the object eg. "registry"
+        factory: function with no arguments building the object, it may ask for other shared objects
+        """
+        with self._shared_lock:
+            if name not in self._shared:
+                self._shared[name] = factory()
+            return self._shared[name]
+
+    def connect(self):
+        """Opens a new DB-API connection"""
+        raise NotImplementedError
+
+    def table(self, name):
+        """Name a warehouse table has to be referred to by in SQL statements"""
+        return name
+
+    def sql(self, statement):
+        """Fills in the {Table} placeholders of a statement with the backend's table names"""
+        return statement.format(**{name: self.table(name) for name in TABLES})
+
+    def schema(self):
+        """Statements creating the warehouse tables if they do not exist yet"""
+        raise NotImplementedError
+
+    def cursor(self, conn):
+        """Cursor used for multi statement operations that must share temporary tables"""
+        return conn.cursor()
+
+    def insert_statement(self, table, columns):
+        """Parameterised INSERT statement for the given table and columns"""
+        placeholders = ", ".join("?" * len(columns))
+        return f"INSERT INTO {self.table(table)} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    def insert_rows(self, conn, table, columns, rows):
+        """
+        Sends a batch of rows to a table in one call
+        conn: connection checked out of the pool
+        table: table name eg "StockInformation"
+        columns: column names in the same order as the values in each row
+        rows: list of tuples, one per row
+        """
+        cursor = self.cursor(conn)
+        cursor.executemany(self.insert_statement(table, columns), rows)
+
+    def upsert_rows(self, conn, table, key_columns, columns, rows):
+        """
+        Inserts rows whose key is new and updates the rows whose key already exists as one set based batch
+        Relies on the unique index over the key columns
+        conn: connection checked out of the pool
+        table: table name eg "StockInformation"
+        key_columns: columns identifying a row eg ["TickerSymbol", "Date"]
+        columns: column names in the same order as the values in each row
+        rows: list of tuples, one per row
+        """
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key_columns)
+        statement = f"{self.insert_statement(table, columns)} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+        cursor = self.cursor(conn)
+        cursor.executemany(statement, rows)
+
+    def create_schema(self, conn):
+        """Creates the warehouse tables on the given connection"""
+        cursor = conn.cursor()
+        for statement in self.schema():
+            cursor.execute(statement)
+        conn.commit()
+        self.create_unique_index(conn)
+        # warehouses created before the ticker registry existed get it filled in from the prices already held
+        cursor.execute(self.sql("""
+            INSERT INTO {StockTickers} (TickerSymbol, FirstDate, LastDate, DayCount, LastSync)
+            SELECT TickerSymbol, MIN(Date), MAX(Date), COUNT(*), CURRENT_TIMESTAMP
+            FROM {StockInformation}
+            WHERE NOT EXISTS (SELECT 1 FROM {StockTickers})
+            GROUP BY TickerSymbol
+        """))
+        conn.commit()
+
+    def create_unique_index(self, conn):
+        """
+        Adds the unique (TickerSymbol, Date) index that upserts rely on
+        Warehouses created before the index existed can hold duplicate days, those are removed first keeping the oldest row
+        """
+        cursor = self.cursor(conn)
+        statement = f"CREATE UNIQUE INDEX IF NOT EXISTS UX_StockInformation_Ticker_Date ON {self.table('StockInformation')} (TickerSymbol, Date)"
+        try:
+            cursor.execute(statement)
+        except Exception:
+            cursor.execute(self.sql("""
+                DELETE FROM {StockInformation}
+                WHERE StockID NOT IN (
+                    SELECT MIN(StockID)
+                    FROM {StockInformation}
+                    GROUP BY TickerSymbol, Date
+                )
+            """))
+            cursor.execute(statement)
+        conn.commit()
+
+
+class SQLServerBackend(StorageBackend):
+    """The SQL Server data warehouse, see SQL/SQLWarehouse_table.sql for the schema"""
+    name = "sqlserver"
+
+    def __init__(self, server, database, username, password, driver="{SQL Server Native Client 11.0}", **pool_options):
+        super().__init__(**pool_options)
+        self.server = server
+        self.database = database
+        self.username = username
+        self.password = password
+        self.driver = driver
+
+    def connect(self):
+        import pyodbc
+        # if there is a time where the sql connection lags with no error there maybe an issue with the drivers being updated
+        # without your knowledge
+        return pyodbc.connect(driver=self.driver, server=self.server, database=self.database,
+                              uid=self.username, pwd=self.password)
+
+    def table(self, name):
+        # temporary and staging tables are left unqualified
+        if name not in TABLES:
+            return name
+        return f"[{self.database}].dbo.{name}"
+
+    def insert_rows(self, conn, table, columns, rows):
+        cursor = self.cursor(conn)
+        # binds the whole batch as parameter arrays instead of one round trip per row
+        cursor.fast_executemany = True
+        cursor.executemany(self.insert_statement(table, columns), rows)
+
+    def upsert_rows(self, conn, table, key_columns, columns, rows):
+        # loading the batch into a temporary table lets a single MERGE do the check, update and insert for every row
+        # the unique clustered index on (TickerSymbol, Date) turns the match into an index seek
+        staging = f"#{table}Staging"
+        target = self.table(table)
+        cursor = self.cursor(conn)
+        cursor.execute(f"IF OBJECT_ID('tempdb..{staging}') IS NOT NULL DROP TABLE {staging}")
+        cursor.execute(f"SELECT {', '.join(columns)} INTO {staging} FROM {target} WHERE 1 = 0")
+        self.insert_rows(conn, staging, columns, rows)
+
+        matches = " AND ".join(f"t.{key} = s.{key}" for key in key_columns)
+        updates = ", ".join(f"t.{column} = s.{column}" for column in columns if column not in key_columns)
+        cursor.execute(f"""
+            MERGE {target} WITH (HOLDLOCK) AS t
+            USING {staging} AS s
+            ON {matches}
+            WHEN MATCHED THEN UPDATE SET {updates}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join('s.' + column for column in columns)});
+        """)
+        cursor.execute(f"DROP TABLE {staging}")
+
+    def schema(self):
+        return [
+            """
+            IF OBJECT_ID('dbo.StockInformation', 'U') IS NULL
+            CREATE TABLE dbo.StockInformation (
+                StockID INT IDENTITY(1,1) NOT NULL,
+                TickerSymbol NVARCHAR(10) NOT NULL,
+                Date DATE NOT NULL,
+                OpenPrice FLOAT,
+                ClosePrice FLOAT,
+                HighPrice FLOAT,
+                LowPrice FLOAT,
+                Volume BIGINT,
+                CONSTRAINT PK_StockInformation PRIMARY KEY NONCLUSTERED (StockID)
+            )
+            """,
+            """
+            IF OBJECT_ID('dbo.StockTickers', 'U') IS NULL
+            CREATE TABLE dbo.StockTickers (
+                TickerSymbol NVARCHAR(10) NOT NULL PRIMARY KEY,
+                FirstDate DATE,
+                LastDate DATE,
+                DayCount INT,
+                LastSync DATETIME2(0)
+            )
+            """,
+            """
+            IF OBJECT_ID('dbo.StockEmptySessions', 'U') IS NULL
+            CREATE TABLE dbo.StockEmptySessions (
+                TickerSymbol NVARCHAR(10) NOT NULL,
+                Date DATE NOT NULL,
+                CheckedAt DATETIME2(0),
+                CONSTRAINT PK_StockEmptySessions PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+            )
+            """,
+            f"""
+            IF OBJECT_ID('dbo.StockIndicators', 'U') IS NULL
+            CREATE TABLE dbo.StockIndicators (
+                TickerSymbol NVARCHAR(10) NOT NULL,
+                Date DATE NOT NULL,
+                {", ".join(f"{column} FLOAT" for column in INDICATOR_COLUMNS)},
+                CONSTRAINT PK_StockIndicators PRIMARY KEY CLUSTERED (TickerSymbol, Date)
+            )
+            """,
+        ] + [
+            f"""
+            IF OBJECT_ID('dbo.{table}', 'U') IS NULL
+            CREATE TABLE dbo.{table} (
+                TickerSymbol NVARCHAR(10) NOT NULL,
+                PeriodStart DATE NOT NULL,
+                PeriodEnd DATE NOT NULL,
+                OpenPrice FLOAT,
+                ClosePrice FLOAT,
+                HighPrice FLOAT,
+                LowPrice FLOAT,
+                Volume BIGINT,
+                DayCount INT,
+                CONSTRAINT PK_{table} PRIMARY KEY CLUSTERED (TickerSymbol, PeriodStart)
+            )
+            """
+            for table in ROLLUP_TABLES
+        ]
+
+    def create_unique_index(self, conn):
+        # existing warehouses are moved over with SQL/SQLWarehouse_migration_unique_ticker_date.sql
+        cursor = conn.cursor()
+        cursor.execute("""
+            IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_StockInformation_Ticker_Date')
+            CREATE UNIQUE CLUSTERED INDEX UX_StockInformation_Ticker_Date ON dbo.StockInformation (TickerSymbol, Date)
+        """)
+        conn.commit()
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite file, dates come back as datetime.date like they do from SQL Server"""
+    name = "sqlite"
+
+    def __init__(self, path, **pool_options):
+        super().__init__(**pool_options)
+        # every connection to ":memory:" would be a separate empty database
+        if path == ":memory:":
+            raise ValueError("the SQLite backend needs a file path so pooled connections share the same data")
+        self.path = path
+        self._schema_ready = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, timeout=30)
+        if not self._schema_ready:
+            self.create_schema(conn)
+            self._schema_ready = True
+        return conn
+
+    def schema(self):
+        return [
+            """
+            CREATE TABLE IF NOT EXISTS StockInformation (
+                StockID INTEGER PRIMARY KEY AUTOINCREMENT,
+                TickerSymbol TEXT NOT NULL,
+                Date DATE NOT NULL,
+                OpenPrice REAL,
+                ClosePrice REAL,
+                HighPrice REAL,
+                LowPrice REAL,
+                Volume INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS StockTickers (
+                TickerSymbol TEXT NOT NULL PRIMARY KEY,
+                FirstDate DATE,
+                LastDate DATE,
+                DayCount INTEGER,
+                LastSync TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS StockEmptySessions (
+                TickerSymbol TEXT NOT NULL,
+                Date DATE NOT NULL,
+                CheckedAt TIMESTAMP,
+                PRIMARY KEY (TickerSymbol, Date)
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS StockIndicators (
+                TickerSymbol TEXT NOT NULL,
+                Date DATE NOT NULL,
+                {", ".join(f"{column} REAL" for column in INDICATOR_COLUMNS)},
+                PRIMARY KEY (TickerSymbol, Date)
+            )
+            """,
+        ] + [
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                TickerSymbol TEXT NOT NULL,
+                PeriodStart DATE NOT NULL,
+                PeriodEnd DATE NOT NULL,
+                OpenPrice REAL,
+                ClosePrice REAL,
+                HighPrice REAL,
+                LowPrice REAL,
+                Volume INTEGER,
+                DayCount INTEGER,
+                PRIMARY KEY (TickerSymbol, PeriodStart)
+            )
+            """
+            for table in ROLLUP_TABLES
+        ]
+
+
+class DuckDBBackend(StorageBackend):
+    """Embedded DuckDB file, a columnar engine suited to scanning years of history for many tickers"""
+    name = "duckdb"
+
+    def __init__(self, path, **pool_options):
+        super().__init__(**pool_options)
+        self.path = path
+        self._schema_ready = False
+
+    def connect(self):
+        import duckdb
+        conn = duckdb.connect(self.path)
+        if not self._schema_ready:
+            self.create_schema(conn)
+            self._schema_ready = True
+        return conn
+
+    def cursor(self, conn):
+        # DuckDB cursors are separate connections that cannot see each other's temporary tables
+        return conn
+
+    def insert_rows(self, conn, table, columns, rows):
+        import pandas as pd
+        # DuckDB binds executemany row by row, scanning a registered frame uses its native columnar append instead
+        batch = pd.DataFrame.from_records(rows, columns=columns)
+        conn.register("insert_batch", batch)
+        try:
+            conn.execute(f"INSERT INTO {self.table(table)} ({', '.join(columns)}) SELECT * FROM insert_batch")
+        finally:
+            conn.unregister("insert_batch")
+
+    def upsert_rows(self, conn, table, key_columns, columns, rows):
+        import pandas as pd
+        batch = pd.DataFrame.from_records(rows, columns=columns)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key_columns)
+        conn.register("upsert_batch", batch)
+        try:
+            conn.execute(f"""
+                INSERT INTO {self.table(table)} ({', '.join(columns)}) SELECT * FROM upsert_batch
+                ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}
+            """)
+        finally:
+            conn.unregister("upsert_batch")
+
+    def schema(self):
+        return [
+            "CREATE SEQUENCE IF NOT EXISTS StockInformationID",
+            """
+            CREATE TABLE IF NOT EXISTS StockInformation (
+                StockID BIGINT PRIMARY KEY DEFAULT nextval('StockInformationID'),
+                TickerSymbol VARCHAR NOT NULL,
+                Date DATE NOT NULL,
+                OpenPrice DOUBLE,
+                ClosePrice DOUBLE,
+                HighPrice DOUBLE,
+                LowPrice DOUBLE,
+                Volume BIGINT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS StockTickers (
+                TickerSymbol VARCHAR NOT NULL PRIMARY KEY,
+                FirstDate DATE,
+                LastDate DATE,
+                DayCount BIGINT,
+                LastSync TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS StockEmptySessions (
+                TickerSymbol VARCHAR NOT NULL,
+                Date DATE NOT NULL,
+                CheckedAt TIMESTAMP,
+                PRIMARY KEY (TickerSymbol, Date)
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS StockIndicators (
+                TickerSymbol VARCHAR NOT NULL,
+                Date DATE NOT NULL,
+                {", ".join(f"{column} DOUBLE" for column in INDICATOR_COLUMNS)},
+                PRIMARY KEY (TickerSymbol, Date)
+            )
+            """,
+        ] + [
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                TickerSymbol VARCHAR NOT NULL,
+                PeriodStart DATE NOT NULL,
+                PeriodEnd DATE NOT NULL,
+                OpenPrice DOUBLE,
+                ClosePrice DOUBLE,
+                HighPrice DOUBLE,
+                LowPrice DOUBLE,
+                Volume BIGINT,
+                DayCount BIGINT,
+                PRIMARY KEY (TickerSymbol, PeriodStart)
+            )
+            """
+            for table in ROLLUP_TABLES
+        ]
+
+
+# SQLite stores dates as ISO text, registering the adapter here avoids the deprecated default one
+sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+sqlite3.register_converter("DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+BACKENDS = {
+    "sqlserver": SQLServerBackend,
+    "sqlite": SQLiteBackend,
+    "duckdb": DuckDBBackend,
+}
+
+_shared_backend = None
+_shared_lock = threading.Lock()
+
+
+def backend_from_config(section):
+    """
+    Builds a backend from a configuration section
+    section: the [Data Warehouse] section, backend picks the engine and defaults to sqlserver
+    """
+    pool_options = {
+        "pool_size": section.getint("pool_size", 5),
+        "pool_timeout": section.getfloat("pool_timeout", 30),
+        "check_interval": section.getfloat("health_check_interval", 60),
+    }
+    kind = section.get("backend", "sqlserver").lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown data warehouse backend: {kind}")
+    if kind == "sqlserver":
+        return SQLServerBackend(section["server"], section["database"], section["username"], section["password"],
+                                **pool_options)
+    return BACKENDS[kind](section["path"], **pool_options)
+
+
+def get_backend():
+    """Returns the backend shared by the whole process, built from the configuration file on first use"""
+    global _shared_backend
+    with _shared_lock:
+        if _shared_backend is None:
+            _shared_backend = backend_from_config(load_config()["Data Warehouse"])
+        return _shared_backend
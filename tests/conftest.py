@@ -0,0 +1,61 @@
+# Shared fixtures for the tests, each test gets its own SQLite warehouse in a temporary directory
+# Run from the repository root with python -m pytest
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connection_pool
+import trading_calendar
+from storage_backends import PRICE_COLUMNS, SQLiteBackend
+from ticker_registry import get_registry
+
+
+def price_history(ticker, first, last, seed=0):
+    """
+    Random walk daily prices of one ticker on the NYSE calendar
+    Returns a list of row tuples in the PRICE_COLUMNS order
+    """
+    days = trading_calendar.trading_days(first, last)
+    rng = np.random.default_rng(seed)
+    closes = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+    return [(ticker, day, close, close, close * 1.01, close * 0.99, 1000) for day, close in zip(days, closes.tolist())]
+
+
+@pytest.fixture(autouse=True)
+def config(tmp_path):
+    """Configuration file without a mirror or any credentials, so nothing outside the temporary directory is used"""
+    path = tmp_path / "config.ini"
+    path.write_text("[Alpha Vantage]\napi_key = test\n\n[Data Warehouse]\nbackend = sqlite\n"
+                    f"path = {tmp_path / 'warehouse.db'}\nsync_repair_days = 30\n")
+    previous = connection_pool.CONFIG_PATH
+    connection_pool.use_config(str(path))
+    yield connection_pool.load_config()
+    connection_pool.use_config(previous)
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    """Empty SQLite backend, call load(rows) on it to write prices and register the tickers"""
+    backend = SQLiteBackend(str(tmp_path / "warehouse.db"))
+
+    def load(rows):
+        with backend.pool.connection() as conn:
+            backend.upsert_rows(conn, "StockInformation", ["TickerSymbol", "Date"], PRICE_COLUMNS, rows)
+            conn.commit()
+        get_registry(backend).refresh(list(dict.fromkeys(row[0] for row in rows)))
+
+    backend.load = load
+    yield backend
+    backend.pool.close()
+
+
+def closes_frame(rows):
+    """Closing prices of the rows as a date x ticker frame"""
+    df = pd.DataFrame(rows, columns=PRICE_COLUMNS)
+    return df.pivot(index="Date", columns="TickerSymbol", values="ClosePrice")
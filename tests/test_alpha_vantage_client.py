@@ -0,0 +1,39 @@
+import pandas as pd
+
+from alpha_vantage_client import OnboardingQueue
+
+
+class FakeClient:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def daily(self, ticker):
+        return pd.DataFrame({"Date": [pd.Timestamp("2024-01-02")], "ClosePrice": [1.0]})
+
+
+def test_client_failure_fails_the_queued_tickers_and_restarts():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise KeyError("api_key")
+        return FakeClient()
+
+    loaded = []
+    queue = OnboardingQueue(lambda ticker, frame: loaded.append(ticker), client_factory=factory)
+    queue.submit("AAA")
+    # the thread clears itself once it gave up, a thread still set is waited for
+    thread = queue._thread
+    if thread is not None:
+        thread.join(5)
+    assert queue.state("AAA") == "failed"
+    assert isinstance(queue.errors["AAA"], KeyError)
+
+    assert queue.submit("AAA") == "queued"
+    queue.join(5)
+    assert queue.state("AAA") == "done"
+    assert loaded == ["AAA"] and len(attempts) == 2
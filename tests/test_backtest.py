@@ -0,0 +1,39 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import Backtest
+from conftest import price_history
+
+START = datetime.date(2020, 1, 2)
+END = datetime.date(2023, 12, 29)
+
+
+@pytest.fixture
+def staggered(warehouse):
+    """Three tickers listed on different dates"""
+    rows = price_history("SYN0000", START, END, seed=10)
+    rows += price_history("SYN0001", datetime.date(2020, 9, 1), END, seed=11)
+    rows += price_history("SYN0002", datetime.date(2021, 6, 1), END, seed=12)
+    warehouse.load(rows)
+    return warehouse
+
+
+@pytest.mark.parametrize("strategy, params", [
+    ("crossover", {"fast": "SMA20", "slow": "EMA50"}),
+    ("rsi_threshold", {"period": 14, "lower": 35, "upper": 65}),
+    ("bollinger_breakout", {"window": 20, "num_std": 1.5}),
+])
+def test_multi_ticker_run_matches_single_ticker_runs(staggered, strategy, params):
+    backtest = Backtest(staggered)
+    together = backtest.run(strategy, ["SYN0000", "SYN0001", "SYN0002"], START, END, **params)
+    for ticker in ["SYN0000", "SYN0001", "SYN0002"]:
+        alone = backtest.run(strategy, ticker, START, END, **params)
+        assert alone["summary"].loc[ticker, "Trades"] > 0
+        # the days before a listing add nothing, so the trades and the final equity are the same
+        for figure in ["Trades", "TotalReturn", "MaxDrawdown"]:
+            assert np.isclose(together["summary"].loc[ticker, figure], alone["summary"].loc[ticker, figure]), figure
+        trades = together["trades"][together["trades"]["TickerSymbol"] == ticker].reset_index(drop=True)
+        pd.testing.assert_frame_equal(trades, alone["trades"])
@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+
+import indicators
+from conftest import closes_frame, price_history
+from cross_section import CrossSection
+
+# a Friday, the day after is a Saturday without prices
+LAST_SESSION = datetime.date(2024, 6, 28)
+
+
+def load_universe(warehouse):
+    rows = price_history("AAA", datetime.date(2023, 1, 3), LAST_SESSION, seed=1)
+    rows += price_history("BBB", datetime.date(2023, 1, 3), LAST_SESSION, seed=2)
+    warehouse.load(rows)
+    return closes_frame(rows)
+
+
+def test_screen_on_bollinger_band(warehouse):
+    closes = load_universe(warehouse)
+    result = CrossSection(warehouse).screen(["Close > BB20_Lower"], as_of=LAST_SESSION)
+
+    lower = {ticker: indicators.bollinger_bands(closes[ticker].to_numpy(), 20, 2)[2][-1] for ticker in closes}
+    expected = sorted(ticker for ticker in closes if closes[ticker].iloc[-1] > lower[ticker])
+    assert sorted(result["TickerSymbol"]) == expected
+    assert np.allclose(result.set_index("TickerSymbol")["BB20_Lower"], [lower[ticker] for ticker in expected])
+
+
+def test_screen_defaults_to_the_last_session(warehouse):
+    load_universe(warehouse)
+    result = CrossSection(warehouse).screen(["RSI14 > 0"])
+    assert sorted(result["TickerSymbol"]) == ["AAA", "BBB"]
+    assert (result["Date"] == LAST_SESSION).all()
+
+
+def test_screen_on_a_day_without_prices(warehouse):
+    load_universe(warehouse)
+    result = CrossSection(warehouse).screen(["RSI14 > 0"], as_of=LAST_SESSION + datetime.timedelta(days=1))
+    assert sorted(result["TickerSymbol"]) == ["AAA", "BBB"]
+    assert (result["Date"] == LAST_SESSION).all()
+
+
+def test_screen_on_prices_only(warehouse):
+    load_universe(warehouse)
+    result = CrossSection(warehouse).screen(["Close > 0"], as_of=LAST_SESSION + datetime.timedelta(days=2))
+    assert sorted(result["TickerSymbol"]) == ["AAA", "BBB"]
+
+
+def test_screen_without_prices(warehouse):
+    result = CrossSection(warehouse).screen(["Close > 0", "SMA50 > 0"])
+    assert result.empty
+    assert list(result.columns) == ["TickerSymbol", "Date", "ClosePrice", "SMA50"]
+
+
+def test_rsi_matches_the_full_history(warehouse):
+    closes = load_universe(warehouse)
+    full = {ticker: indicators.rsi(closes[ticker].to_numpy(), 14)[-1] for ticker in closes}
+    result = CrossSection(warehouse).screen(["RSI14 > 0"], as_of=LAST_SESSION).set_index("TickerSymbol")
+    assert np.allclose(result.loc[list(full), "RSI14"], list(full.values()), atol=1e-3)
@@ -0,0 +1,35 @@
+import datetime
+
+import numpy as np
+
+import indicator_job
+from conftest import price_history
+from storage_backends import INDICATOR_COLUMNS
+
+HOLE = datetime.date(2023, 6, 15)
+
+
+def stored(warehouse):
+    with warehouse.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT Date, {', '.join(INDICATOR_COLUMNS)} FROM StockIndicators WHERE TickerSymbol = 'AAA' ORDER BY Date")
+        return cursor.fetchall()
+
+
+def test_filled_hole_is_rewritten(warehouse):
+    rows = price_history("AAA", datetime.date(2023, 1, 3), datetime.date(2023, 12, 29), seed=6)
+    warehouse.load([row for row in rows if row[1] != HOLE])
+    indicator_job.run(workers=1, backend=warehouse)
+    assert indicator_job.first_missing_dates(warehouse, ["AAA"]) == {}
+
+    # the hole is filled before the high water mark, the prices after it are unchanged
+    warehouse.load([row for row in rows if row[1] == HOLE])
+    assert indicator_job.first_missing_dates(warehouse, ["AAA"]) == {"AAA": HOLE}
+    written = indicator_job.run(workers=1, backend=warehouse)
+    assert written == len([row for row in rows if row[1] >= HOLE])
+
+    _, dates, values = indicator_job.compute_ticker("AAA", backend=warehouse)
+    table = stored(warehouse)
+    assert len(table) == len(rows)
+    assert np.allclose(np.array([row[1:] for row in table], dtype=float), values, equal_nan=True)
+    assert indicator_job.run(workers=1, backend=warehouse) == 0
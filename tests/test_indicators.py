@@ -0,0 +1,111 @@
+import math
+import statistics
+
+import numpy as np
+import pytest
+
+import indicators
+
+# series long enough for every window, shorter than the windows and empty
+LENGTHS = [300, 5, 0]
+
+
+def prices(length, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.02, length)))
+
+
+def legacy_sma(closes, window):
+    """Two pointer loop of the original StockMetrics, every full window"""
+    return [sum(closes[start:start + window]) / window for start in range(len(closes) - window + 1)]
+
+
+def legacy_ema(closes, window):
+    """Recursion of the original StockMetrics with its 1 / (2/window + 1) smoothing"""
+    if not closes:
+        return []
+    line = [closes[0]]
+    for close in closes[1:]:
+        line.append((close - line[-1]) / (2 / window + 1) + line[-1])
+    return line
+
+
+def legacy_stdev(closes, window):
+    """statistics.stdev over every full window, as the original Bollinger bands used it"""
+    return [statistics.stdev(closes[start:start + window]) for start in range(len(closes) - window + 1)]
+
+
+def wilder_rsi(closes, period):
+    """Wilder's RSI one day at a time, seeded with the plain average of the first period changes"""
+    def index(gain, loss):
+        if loss == 0:
+            return 50.0 if gain == 0 else 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+    out = [math.nan] * len(closes)
+    if len(closes) <= period:
+        return out
+    changes = [closes[i] - closes[i - 1] for i in range(1, len(closes))]
+    gain = sum(max(change, 0) for change in changes[:period]) / period
+    loss = sum(max(-change, 0) for change in changes[:period]) / period
+    out[period] = index(gain, loss)
+    for i in range(period + 1, len(closes)):
+        change = changes[i - 1]
+        gain = (gain * (period - 1) + max(change, 0)) / period
+        loss = (loss * (period - 1) + max(-change, 0)) / period
+        out[i] = index(gain, loss)
+    return out
+
+
+@pytest.mark.parametrize("length", LENGTHS)
+@pytest.mark.parametrize("window", [1, 20, 50])
+def test_sma_matches_the_loop(length, window):
+    closes = prices(length)
+    result = indicators.sma(closes, window)
+    assert len(result) == length
+    assert np.isnan(result[:window - 1]).all()
+    assert np.allclose(result[window - 1:], legacy_sma(closes.tolist(), window))
+
+
+@pytest.mark.parametrize("length", LENGTHS)
+@pytest.mark.parametrize("window", [2, 12, 50])
+def test_ema_with_the_legacy_alpha_matches_the_loop(length, window):
+    closes = prices(length)
+    result = indicators.ema(closes, window, alpha=1 / (2 / window + 1))
+    assert np.allclose(result, legacy_ema(closes.tolist(), window))
+
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_bollinger_bands_match_statistics_stdev(length):
+    closes = prices(length)
+    upper, middle, lower = indicators.bollinger_bands(closes, 20, 2)
+    deviation = legacy_stdev(closes.tolist(), 20)
+    average = legacy_sma(closes.tolist(), 20)
+    assert np.allclose(middle[19:], average)
+    assert np.allclose(upper[19:], np.array(average) + 2 * np.array(deviation))
+    assert np.allclose(lower[19:], np.array(average) - 2 * np.array(deviation))
+    assert np.isnan(upper[:19]).all() and np.isnan(lower[:19]).all()
+
+
+def test_rolling_std_on_large_flat_prices():
+    closes = np.full(40, 1e6) + np.tile([0.0, 0.01], 20)
+    assert np.allclose(indicators.rolling_std(closes, 20)[19:], legacy_stdev(closes.tolist(), 20))
+
+
+@pytest.mark.parametrize("length", LENGTHS + [15, 16])
+@pytest.mark.parametrize("period", [2, 14])
+def test_rsi_matches_wilder_loop(length, period):
+    closes = prices(length, seed=3)
+    assert np.allclose(indicators.rsi(closes, period), wilder_rsi(closes.tolist(), period), equal_nan=True)
+
+
+def test_rsi_without_losses_or_changes():
+    assert indicators.rsi(np.arange(1.0, 31.0), 14)[-1] == 100.0
+    assert indicators.rsi(np.full(30, 5.0), 14)[-1] == 50.0
+
+
+def test_2d_input_is_one_series_per_column():
+    matrix = np.column_stack([prices(120, seed) for seed in range(3)])
+    for name, columns in indicators.compute_indicators(matrix, ["SMA20", "EMA10", "RSI14", "BB20"]).items():
+        single = [indicators.compute_indicators(matrix[:, k], [name.split("_")[0]]) for k in range(3)]
+        assert np.allclose(columns, np.column_stack([s[name] for s in single]), equal_nan=True), name
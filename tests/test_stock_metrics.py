@@ -0,0 +1,60 @@
+import datetime
+import statistics
+
+import numpy as np
+import pytest
+
+import indicators
+from conftest import price_history
+from stock_metrics import StockMetrics
+from test_indicators import legacy_ema, legacy_sma, wilder_rsi
+
+START = datetime.date(2023, 1, 3)
+END = datetime.date(2023, 12, 29)
+
+
+@pytest.fixture
+def metrics(warehouse):
+    warehouse.load(price_history("AAA", START, END, seed=4))
+    warehouse.load(price_history("TINY", START, datetime.date(2023, 1, 6), seed=5))
+    return StockMetrics(warehouse)
+
+
+def test_simple_moving_average_matches_the_two_pointer_loop(metrics):
+    prices, dates, line, line_dates = metrics.simple_moving_average("AAA", START, END, 7)
+    # the original loop stopped one window before the last close
+    assert np.allclose(line, legacy_sma(prices, 7)[:-1])
+    assert line_dates == dates[6:-1]
+
+
+def test_exponential_moving_average_matches_the_legacy_recursion(metrics):
+    prices, dates, line = metrics.exponentail_moving_average("AAA", START, END, 12)
+    assert np.allclose(line, legacy_ema(prices, 12))
+
+
+def test_bollinger_bands_use_statistics_stdev_over_the_sma_windows(metrics):
+    upper, lower, middle, _ = metrics.bollinger_bands("AAA", START, END)
+    prices = metrics.c_price_plot
+    deviation = [statistics.stdev(prices[i:i + 20]) for i in range(len(middle))]
+    assert np.allclose(upper, np.array(middle) + 2 * np.array(deviation))
+    assert np.allclose(lower, np.array(middle) - 2 * np.array(deviation))
+
+
+def test_relative_strength_index_is_the_last_wilder_value(metrics):
+    prices, _, _ = metrics.exponentail_moving_average("AAA", START, END, 12)
+    assert metrics.reletive_strength_index("AAA", START, END) == round(wilder_rsi(prices, 14)[-1], 4)
+
+
+def test_short_and_empty_series(metrics):
+    assert metrics.reletive_strength_index("TINY", START, END) is None
+    assert metrics.simple_moving_average("TINY", START, END, 7)[2] == []
+    assert metrics.exponentail_moving_average("NONE", START, END, 12) == ([], [], [])
+    assert metrics.bollinger_bands("TINY", START, END)[:3] == ([], [], [])
+
+
+def test_indicator_frame_rsi_matches_the_full_history(metrics):
+    prices, dates, _ = metrics.exponentail_moving_average("AAA", START, END, 12)
+    full = indicators.rsi(np.array(prices), 14)
+    frame = metrics.indicator_frame("AAA", ["RSI14"], days=30, end_date=END)
+    expected = dict(zip(dates, full))
+    assert np.allclose(frame["RSI14"], [expected[day] for day in frame["Date"]], atol=1e-3)
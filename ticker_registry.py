@@ -0,0 +1,136 @@
+# The purpose of this file is to keep track of which stocks are in the data warehouse
+# The StockTickers table holds one row per ticker with its date range, number of days held and last sync time so nothing has to
+# scan StockInformation to find out what is there. Each process also keeps the set of tickers in memory for existence checks.
+
+import datetime
+import threading
+
+from storage_backends import QUERY_CHUNK
+
+
+class TickerRegistry:
+    def __init__(self, backend):
+        """
+        backend: storage backend holding the warehouse
+        """
+        self.backend = backend
+        self._known = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def _load(self):
+        """Reads every registered ticker into the in memory set"""
+        with self.backend.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql("SELECT TickerSymbol FROM {StockTickers}"))
+            return frozenset(row[0] for row in cursor.fetchall())
+
+    def contains(self, ticker):
+        """
+        Whether the ticker is in the warehouse, answered from memory after the first call
+        ticker: ticker name eg "AAPL"
+        """
+        known = self._known
+        if known is None:
+            with self._lock:
+                if self._known is None:
+                    self._known = self._load()
+                known = self._known
+        return ticker in known
+
+    def subscribe(self, callback, first=False):
+        """
+        Registers a function called with the list of tickers every time new rows are written for them
+        callback: function taking a list of tickers eg. a cache's invalidate method
+        first: call it before the callbacks already registered, for copies of the data other callbacks read from
+        """
+        if first:
+            self._listeners.insert(0, callback)
+        else:
+            self._listeners.append(callback)
+
+    def invalidate(self):
+        """Drops the in memory set so the next check reads the table again"""
+        with self._lock:
+            self._known = None
+
+    def tickers(self):
+        """Every registered ticker in alphabetical order"""
+        with self.backend.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql("SELECT TickerSymbol FROM {StockTickers} ORDER BY TickerSymbol"))
+            return [row[0] for row in cursor.fetchall()]
+
+    def entries(self, tickers=None):
+        """
+        Registry rows as a dict of ticker to (FirstDate, LastDate, DayCount, LastSync)
+        tickers: optional list of tickers to limit the result to
+        """
+        with self.backend.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.backend.sql("""
+                SELECT TickerSymbol, FirstDate, LastDate, DayCount, LastSync
+                FROM {StockTickers}
+            """))
+            data = cursor.fetchall()
+        entries = {row[0]: tuple(row[1:]) for row in data}
+        if tickers is not None:
+            entries = {ticker: entries[ticker] for ticker in tickers if ticker in entries}
+        return entries
+
+    def refresh(self, tickers=None):
+        """
+        Recomputes the registry rows of the given tickers from StockInformation after new rows were written
+        tickers: tickers that were written to, defaults to every ticker in StockInformation
+        """
+        synced = datetime.datetime.now().replace(microsecond=0)
+        statement = """
+            SELECT s.TickerSymbol, MIN(s.Date), MAX(s.Date), COUNT(*)
+            FROM {StockInformation} s
+        """
+        if tickers is None:
+            chunks = [None]
+        else:
+            tickers = list(dict.fromkeys(tickers))
+            chunks = [tickers[i:i + QUERY_CHUNK] for i in range(0, len(tickers), QUERY_CHUNK)]
+
+        with self.backend.pool.connection() as conn:
+            cursor = conn.cursor()
+            rows = []
+            for chunk in chunks:
+                if chunk is None:
+                    cursor.execute(self.backend.sql(statement + " GROUP BY s.TickerSymbol"))
+                elif chunk:
+                    where = f" WHERE s.TickerSymbol IN ({', '.join('?' * len(chunk))}) GROUP BY s.TickerSymbol"
+                    cursor.execute(self.backend.sql(statement + where), chunk)
+                else:
+                    continue
+                rows.extend((ticker, _as_date(first), _as_date(last), count, synced)
+                            for ticker, first, last, count in cursor.fetchall())
+            if rows:
+                self.backend.upsert_rows(conn, "StockTickers", ["TickerSymbol"],
+                                         ["TickerSymbol", "FirstDate", "LastDate", "DayCount", "LastSync"], rows)
+            conn.commit()
+
+        # only new tickers change the set, existing ones just had their dates moved on
+        if any(not self.contains(row[0]) for row in rows):
+            self.invalidate()
+        # letting caches built on the old rows know they are stale
+        written = [row[0] for row in rows]
+        for callback in self._listeners:
+            callback(written)
+        return len(rows)
+
+
+def _as_date(value):
+    """Aggregated dates come back as ISO text from some engines"""
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def get_registry(backend):
+    """Returns the registry shared by everything in the process using the given backend"""
+    return backend.shared("registry", lambda: TickerRegistry(backend))
@@ -0,0 +1,76 @@
+# The purpose of this file is to know which days the US stock market is open
+# The holiday rules follow the NYSE schedule so syncs only ask for days that can actually have prices
+
+import datetime
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from pandas.tseries.holiday import (AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay,
+                                    USMartinLutherKingJr, USMemorialDay, USPresidentsDay,
+                                    USThanksgivingDay, nearest_workday, sunday_to_monday)
+from pandas.tseries.offsets import CustomBusinessDay
+
+# the exchange closes at 16:00 New York time, prices for a session are final after that
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_CLOSE = datetime.time(16, 0)
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full day NYSE holidays"""
+    rules = [
+        # the NYSE does not close on the Friday before a Saturday New Year's Day
+        Holiday("New Year's Day", month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday("Juneteenth", month=6, day=19, start_date="2022-01-01", observance=nearest_workday),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas Day", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+TRADING_DAY = CustomBusinessDay(calendar=NYSEHolidayCalendar())
+
+
+def trading_days(start, end):
+    """
+    Trading sessions between two dates, both ends included
+    start: first date considered
+    end: last date considered
+    Returns a list of datetime.date
+    """
+    if pd.Timestamp(start) > pd.Timestamp(end):
+        return []
+    return [day.date() for day in pd.date_range(start, end, freq=TRADING_DAY)]
+
+
+def is_trading_day(day):
+    """True when the market has a session on the given date"""
+    return len(trading_days(day, day)) == 1
+
+
+def previous_trading_day(day):
+    """Last trading session strictly before the given date"""
+    return (pd.Timestamp(day) - TRADING_DAY).date()
+
+
+def next_trading_day(day):
+    """First trading session strictly after the given date"""
+    return (pd.Timestamp(day) + TRADING_DAY).date()
+
+
+def last_completed_session(now=None):
+    """
+    Most recent session whose closing prices are final
+    now: timezone aware datetime, defaults to the current time
+    """
+    if now is None:
+        now = datetime.datetime.now(MARKET_TIMEZONE)
+    now = now.astimezone(MARKET_TIMEZONE)
+    today = now.date()
+    if is_trading_day(today) and now.time() >= MARKET_CLOSE:
+        return today
+    return previous_trading_day(today)